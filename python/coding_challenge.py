@@ -3,6 +3,11 @@
 
 # This is the main script for performing the matching of listings to products.
 # It accepts 3 command line parameters: productsFilePath listingsFilePath outputFilePath
+# The --jobs option sets the number of processes used to run the matching engines (the default is 1).
+# The --chunk-size option sets the number of listings to read and match at a time (the default is all of them).
+# The --cache-dir option sets a folder in which to cache the parsed input files, to speed up later runs.
+# The --profile-report option sets a file to write the time, memory and row counts of each stage to (as JSON).
+# The same figures are also printed as a table.
 # 
 # It is a cut-down and refactored version of investigation.py.
 # investigation.py is an exploratory script and contains explanations, examples and tests.
@@ -14,17 +19,37 @@
 # However this will remove the ability to be able to run chunks of the code in a REPL,
 # since the indentation level will be wrong.
 
-import sys
-
-# Get file paths from command line arguments:
-if len(sys.argv) != 4:
-    sys.stderr.write("Usage: python %s productsFilePath listingsFilePath outputFilePath" % sys.argv[0])
-    raise SystemExit(1)
-
-productsFilePath = sys.argv[1]
-listingsFilePath = sys.argv[2]
-outputFilePath = sys.argv[3]
-# To test the code in a REPL, set suitable values for these 3 variables,
+import argparse
+
+# Get file paths and options from command line arguments:
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError('%r is not a positive integer' % text)
+    return value
+
+argParser = argparse.ArgumentParser(description='Match listings to products.')
+argParser.add_argument('productsFilePath')
+argParser.add_argument('listingsFilePath')
+argParser.add_argument('outputFilePath')
+argParser.add_argument('--jobs', type=positive_int, default=1, 
+    help='the number of processes to run the matching engines in (default: 1)')
+argParser.add_argument('--chunk-size', type=positive_int, default=None, 
+    help='the number of listings to read and match at a time (default: all of them)')
+argParser.add_argument('--cache-dir', default=None, 
+    help='a folder in which to cache the parsed input files (default: no caching)')
+argParser.add_argument('--profile-report', default=None, 
+    help='a JSON file to write the figures of each stage of the matching to (default: no report)')
+args = argParser.parse_args()
+
+productsFilePath = args.productsFilePath
+listingsFilePath = args.listingsFilePath
+outputFilePath = args.outputFilePath
+jobs = args.jobs
+chunkSize = args.chunk_size
+cacheDir = args.cache_dir
+profileReportFilePath = args.profile_report
+# To test the code in a REPL, set suitable values for these 7 variables,
 # then paste the following code into a REPL...
 
 # ----------------------------------------------------------------------
@@ -34,30 +59,34 @@ import json
 from pandas import DataFrame, Series
 import pandas as pd
 import numpy as np
-from nltk.metrics import *
 import re
-from string import Template
-from math import floor
-from operator import truediv
-import codecs
+from recordlinker.streaming import *
+from recordlinker.fuzzy import *
+from recordlinker.titles import *
+from recordlinker.profiling import *
 
-# Load listings into a data frame:
-listingData = [json.loads(line) for line in open(listingsFilePath)]
-listings = DataFrame(listingData).reset_index()
-listings.rename(columns={'index': 'original_listing_index'}, inplace=True)
+# ----------------------------------------------------------------------
+# Measure the time, memory and row counts of each stage (see StageProfiler).
+# The report is written at the end, if a file was given for it:
+profiler = StageProfiler()
 
 # Load products into a data frame:
-def loadProductsAsDataFrame(productsFilePath):
-    productData = [json.loads(line) for line in open(productsFilePath)]
-    return DataFrame(productData)
-
-products = loadProductsAsDataFrame(productsFilePath)
+def loadProductsAsDataFrame(productsFilePath, cacheDir = None):
+    productChunks = [ DataFrame(productColumns) 
+                      for (lineOffsets, lineLengths, productColumns) 
+                      in read_json_line_chunks(productsFilePath, cache_dir = cacheDir) ]
+    if len(productChunks) == 0:
+        return DataFrame()
+    return productChunks[0]
+
+profiler.start_stage('load products')
+products = loadProductsAsDataFrame(productsFilePath, cacheDir)
+profiler.end_stage(rows_out=len(products))
 
 def getUniqueManufacturersFromDataFrame(dataFrame):
     df = np.sort(dataFrame['manufacturer']).unique()
     return Series(df)
 
-lManufsSeries = getUniqueManufacturersFromDataFrame(listings)
 pManufsSeries = getUniqueManufacturersFromDataFrame(products)
 
 
@@ -83,11 +112,24 @@ pManufKeywords = pManufsMapping['Keyword']
 # 3. Match contained in a single word in the string
 # 4. Sufficiently small Levenshtein distance to a single word in the string
 # 
-def matchListingManufsToProductManufs(pManufsMapping, pManufKeywords):
-    # Set suitable parameters for Levenshtein distances to 
-    # map manufacturers in listings to similar manufacturers in products:
-    edit_distance_threshold = 2
-    min_manuf_word_len = 4
+# Notes: 
+#   1. pManufKeywordsByLManuf caches the keyword matched to each lManuf.
+#      It is shared between the chunks of listings, so that each lManuf is only matched once.
+#      If a cache folder is given, it is also saved there, so that later runs only match new lManufs.
+#   2. The Levenshtein distances are found with a BK-tree of the keywords, 
+#      rather than by calculating the distance from each word to every keyword.
+# 
+
+# Set suitable parameters for Levenshtein distances to 
+# map manufacturers in listings to similar manufacturers in products:
+manufEditDistanceThreshold = 2
+minManufWordLen = 4
+
+def matchListingManufsToProductManufs(listings, pManufsMapping, pManufKeywords, pManufKeywordsByLManuf):
+    edit_distance_threshold = manufEditDistanceThreshold
+    min_manuf_word_len = minManufWordLen
+    pManufKeywordList = list(pManufKeywords)
+    pManufKeywordTree = BKTree([p.lower() for p in pManufKeywordList])
     
     def matchManuf(lManuf):
         splits = lManuf.lower().split()
@@ -101,18 +143,21 @@ def matchListingManufsToProductManufs(pManufsMapping, pManufKeywords):
                        ]
         if len(foundPManufs) > 0:
             return foundPManufs[0]
-        levenshteinPManufs = [ p
-                               for s in splits
-                               for p in pManufKeywords
-                               if len(s) > min_manuf_word_len 
-                               and edit_distance(s, p.lower()) <= edit_distance_threshold
-                             ]
-        if len(levenshteinPManufs) > 0:
-            return levenshteinPManufs[0]
+        for s in splits:
+            if len(s) > min_manuf_word_len:
+                levenshteinPManufIds = pManufKeywordTree.find_within(s, edit_distance_threshold)
+                if len(levenshteinPManufIds) > 0:
+                    return pManufKeywordList[levenshteinPManufIds[0]]
         return ''
     
+    def matchManufWithCache(lManuf):
+        if not lManuf in pManufKeywordsByLManuf:
+            pManufKeywordsByLManuf[lManuf] = matchManuf(lManuf)
+        return pManufKeywordsByLManuf[lManuf]
+    
+    lManufsSeries = getUniqueManufacturersFromDataFrame(listings)
     mapData = { 'lManuf': lManufsSeries,
-                'pManufKeyword': lManufsSeries.apply( matchManuf )
+                'pManufKeyword': lManufsSeries.apply( matchManufWithCache )
               }
     lManufMap = DataFrame( mapData )
     lManufMap = pd.merge( lManufMap, pManufsMapping, how='left', left_on='pManufKeyword', right_on='Keyword')
@@ -126,77 +171,58 @@ def matchListingManufsToProductManufs(pManufsMapping, pManufKeywords):
     return listingsByPManufAll[listingsByPManufAll['pManuf'] != ''].reindex(
         columns = ['pManuf','lManuf', 'title','currency','price', 'original_listing_index'])
 
-listingsByPManuf = matchListingManufsToProductManufs(pManufsMapping, pManufKeywords)
+# ----------------------------------------------------------------------
+# Define terms that filter the product info from ancillary info
+#
 
-def separatePrimaryAndSecondaryProductInformation(listingsByPManuf):
-    # ----------------------------------------------------------------------
-    # Define terms that filter the product info from ancillary info
-    #
-    
-    # Languages found by inspecting csv files: English, French, German...
-    applicabilitySplitTerms = [ u'for', u'pour', u'für', u'fur', u'fuer' ]
-    additionalSplitTerms = [ 'with',  'w/', 'avec', 'mit', '+' ]
-    
-    # Build up a regular expression to find terms for splitting 
-    # the product information out from the product it is related to:
-    applicabilityPatterns = '|'.join([ re.escape(term) for term in applicabilitySplitTerms ])
-    additionalPatterns = '|'.join([ re.escape(term) for term in additionalSplitTerms ])
-    allTermPatterns = applicabilityPatterns + '|' + additionalPatterns
-    patternToExpand = ur'''
-    ^
-    \s*
-    (?P<productDesc>
-      (?:
-        (?!
-          (?<!\w)
-          (?:$allTermPatterns)
-          (?!\w)
-        )
-        .
-      )+
-      # Ensure the last character is non-whitespace:
-      (?:
-        (?!
-          (?<!\w)
-          (?:$allTermPatterns)
-          (?!\w)
-        )
-        \S
-      )
-    )
-    \s*
-    (?:
-      (?P<extraProdDetailsSection>
-        (?:
-          (?:$allTermPatterns)
-          \W*
-        )
-        (?P<extraProdDetails>
-          .+
-          \S # Ensure the last character is non-whitespace:
-        )
-      )
-      \s*
-    )?
-    $$
-    '''
-    patternTemplate = Template(patternToExpand)
-    titleSplitRegexPattern = patternTemplate.substitute(allTermPatterns=allTermPatterns)
-    titleSplitRegex = re.compile( titleSplitRegexPattern, re.IGNORECASE | re.UNICODE | re.VERBOSE )
-    
-    # ----------------------------------------------------------------------
-    # Split the product titles into a product description and ancillary information
-    # 
-    def splitTitle(title):
-        titleMatch = titleSplitRegex.match(title)
-        return titleMatch.group('productDesc'), titleMatch.group('extraProdDetails')
+# Languages found by inspecting csv files: English, French, German...
+applicabilitySplitTerms = [ u'for', u'pour', u'für', u'fur', u'fuer' ]
+additionalSplitTerms = [ 'with',  'w/', 'avec', 'mit', '+' ]
 
-    title_regex_pairs = listingsByPManuf['title'].apply(splitTitle)
-    productDescs, extraProdDetails = zip(* title_regex_pairs )
+# ----------------------------------------------------------------------
+# Split the product titles into a product description and ancillary information,
+# at the first of these terms which is a whole word (see recordlinker.titles.TitleSplitter):
+# 
+titleSplitter = TitleSplitter(applicabilitySplitTerms + additionalSplitTerms)
+
+def separatePrimaryAndSecondaryProductInformation(listingsByPManuf):
+    productDescs, extraProdDetails = titleSplitter.split_all(listingsByPManuf['title'])
     listingsByPManuf['productDesc'] = productDescs
     listingsByPManuf['extraProdDetails'] = extraProdDetails
 
-separatePrimaryAndSecondaryProductInformation(listingsByPManuf)
+# ----------------------------------------------------------------------
+# Collapse the listings which share the same manufacturer, product description and extra product details
+# (e.g. where only the price or currency differs), so that each of these is only matched once.
+# 
+# Notes:
+#   1. A new column named 'unique_listing_index' will be added to listingsByPManuf.
+#      It is the index of the listing's row in the returned data frame of unique listings.
+#   2. The 'listing_count' column of the unique listings gives the number of listings sharing it.
+#      This must be used to weight any statistics which count listings.
+#   3. The unique listings are numbered from firstUniqueListingIndex, 
+#      so that the numbers can run on from one chunk of listings to the next.
+# 
+def getUniqueListings(listingsByPManuf, firstUniqueListingIndex = 0):
+    unique_listing_indices_by_key = {}
+    first_listing_positions = []
+    unique_listing_indices = []
+    listing_counts = []
+    listing_keys = zip(listingsByPManuf.pManuf, listingsByPManuf.productDesc, listingsByPManuf.extraProdDetails)
+    for (listing_position, listing_key) in enumerate(listing_keys):
+        unique_listing_index = unique_listing_indices_by_key.get(listing_key)
+        if unique_listing_index is None:
+            unique_listing_index = firstUniqueListingIndex + len(first_listing_positions)
+            unique_listing_indices_by_key[listing_key] = unique_listing_index
+            first_listing_positions.append(listing_position)
+            listing_counts.append(0)
+        listing_counts[unique_listing_index - firstUniqueListingIndex] += 1
+        unique_listing_indices.append(unique_listing_index)
+    
+    listingsByPManuf['unique_listing_index'] = unique_listing_indices
+    uniqueListings = listingsByPManuf[['pManuf', 'productDesc', 'extraProdDetails']].take(first_listing_positions)
+    uniqueListings.index = np.arange(firstUniqueListingIndex, firstUniqueListingIndex + len(first_listing_positions))
+    uniqueListings['listing_count'] = listing_counts
+    return uniqueListings
 
 # ----------------------------------------------------------------------
 # Set the required matching action on the duplicates:
@@ -235,7 +261,9 @@ def markDuplicateProductsToBeIgnored(products):
         #       in the two data frames (products and manuf_model_dups).
     return products
 
+profiler.start_stage('duplicate products', rows_in=len(products))
 products = markDuplicateProductsToBeIgnored(products)
+profiler.end_stage(rows_out=len(products))
 
 
 # ----------------------------------------------------------------------
@@ -338,6 +366,7 @@ def splitModelAndFamilyIntoBlocksAndDeriveAClassificationString(products):
     products['family_blocks'] = family_blocks
     products['family_classification'] = family_classifications
 
+profiler.start_stage('block classification', rows_in=len(products))
 splitModelAndFamilyIntoBlocksAndDeriveAClassificationString(products)
 
 
@@ -367,105 +396,168 @@ def createACompositeClassificationOfFamilyAndModel(products):
     products['blocks'] = products.apply(get_composite_blocks, axis=1)
 
 createACompositeClassificationOfFamilyAndModel(products)
+profiler.end_stage(rows_out=len(products))
+
+
+# ==============================================================================
+# Load matching engine and matching rule classes to calculate 
+# highest value matches between products and listings:
+#
+from recordlinker.classification import *
+from recordlinker.builder import *
+from recordlinker.candidates import *
+from recordlinker.scores import *
+from recordlinker.features import *
+from recordlinker.parallel import *
+
+unique_classifications = products.composite_classification.unique()
+
+
+# ==============================================================================
+# Use the matching engine and matching rule classes to calculate 
+# highest value matches between products and listings:
+#
 
+# -----------------------------------------------------------------------------
+# Generate a master template for each classification:
+profiler.start_stage('engine generation', rows_in=len(products))
+master_template_dict = {
+    classification: MasterTemplateBuilder(classification).build() 
+    for classification in unique_classifications 
+}
+
+# -----------------------------------------------------------------------------
+# Generate a matching engine for each product:
+# 
+def generate_matching_engine(prod_row):
+    classification = prod_row['composite_classification']
+    blocks = prod_row['blocks']
+    family_and_model_len = prod_row['family_and_model_len']
+    master_template = master_template_dict[classification]
+    engine = master_template.generate(blocks, family_and_model_len)
+    return engine
+
+products['matching_engine'] = products.apply(generate_matching_engine, axis=1)
+profiler.end_stage(rows_out=len(products))
 
 # ==============================================================================
 # Extract mega-pixel ratings as an extra criterion to match on.
 # This can be used to resolve ambiguous matches.
 # In particular, the Canon EOS 1-D cameras share the same product code
 # and are differented by Mark number only.
-def extractMegaPixelRatings(listingsByPManuf):
-    mpPattern = r'(\d+(?:[.,]\d+)?)\s*(?:\-\s*)?(?:MP|MPixe?l?s?|(?:(?:mega?|mio\.?)(?:|\-|\s+)pix?e?l?s?))(?:$|\W)'
-    
-    def convert_mp_to_float(s):
-        if isinstance(s, float):
-            return s 
-        else:
-            return float(s.replace(',','.'))
+# 
+# The optical zoom and screen size are extracted in the same pass over each product description
+# (see extract_listing_features). All the features are float32 columns, with NaN where they are missing.
+def extractListingFeatures(uniqueListings):
+    features = extract_listing_features(uniqueListings.productDesc.values)
+    uniqueListings['resolution_in_MP'] = features.megapixels
+    uniqueListings['rounded_MP'] = features.rounded_megapixels
+    uniqueListings['optical_zoom'] = features.optical_zoom
+    uniqueListings['screen_size_in_inches'] = features.screen_size
 
-    listingsByPManuf['resolution_in_MP'] \
-        = listingsByPManuf.productDesc.str.findall(mpPattern, flags=re.IGNORECASE).str.get(0).apply(convert_mp_to_float)
-    listingsByPManuf['rounded_MP'] \
-        = listingsByPManuf.resolution_in_MP[listingsByPManuf.resolution_in_MP.notnull()].apply(lambda mp: floor(mp))
 
-extractMegaPixelRatings(listingsByPManuf)
+profiler.start_stage('product indexing', rows_in=len(products))
 
+# Perform join between products and listings by product,
+# but only for the candidate products found using an index of each manufacturer's product codes.
+# 
+# A ListingContext is created once for each listing. Its normalized product description (and the position 
+# of each normalized character) is used by both the product code index and the product code scanner,
+# and it is shared by all the matching engines for the listing:
+# 
+products_to_match = products.reset_index()[['index', 'manufacturer', 'family', 'model']]
+
+def get_products_and_listings(uniqueListings, products_to_match, product_code_indexes_by_manuf):
+    listings_to_match_columns \
+        = ['index', 'pManuf', 'productDesc', 'extraProdDetails', 'resolution_in_MP', 'rounded_MP', 'listing_count']
+    listings_to_match = uniqueListings.reset_index()[listings_to_match_columns]
+    listings_to_match['listing_context'] = [
+        ListingContext(productDesc, extraProdDetails, memoize_rule_results = True)
+        for (productDesc, extraProdDetails) in zip(listings_to_match.productDesc, listings_to_match.extraProdDetails)
+    ]
+    
+    listing_positions, product_positions = get_candidate_listing_and_product_positions(
+        products_to_match, product_code_indexes_by_manuf, listings_to_match)
+    candidate_listings = listings_to_match.take(listing_positions).reset_index(drop=True)
+    candidate_products = products_to_match.take(product_positions).reset_index(drop=True)
+    candidate_listings.rename(columns={'index': 'index_l'}, inplace=True)
+    candidate_products.rename(columns={'index': 'index_p'}, inplace=True)
+    return candidate_listings.join(candidate_products)
+
+# --------------------------------------------------------------------------
+# Generate candidate pairs of listings and products to match.
+#
+# Every listing matcher of a product's matching engine has mandatory rules
+# whose literal text must be found in the listing's normalized product description.
+# So each manufacturer's products are indexed by these literals (and by their exact match literal).
+# This avoids matching every listing against every product of the same manufacturer.
+#
+def get_product_code_indexes_by_manuf(products):
+    literal_groups_by_index_p = {
+        index_p: engine.get_required_literal_groups() + [[normalize_match_text(family + model)]]
+        for (index_p, family, model, engine)
+        in zip(products.index, products.family.fillna(''), products.model, products.matching_engine)
+    }
+    return {
+        manuf: ProductCodeIndex([ (index_p, literal_groups_by_index_p[index_p]) for index_p in manuf_products.index ])
+        for (manuf, manuf_products) in products.groupby('manufacturer')
+    }
+
+product_code_indexes_by_manuf = get_product_code_indexes_by_manuf(products)
+
+# The pairs are returned as positions into products_to_match and listings_to_match,
+# in the same order as an inner join on the manufacturer would produce:
+#
+def get_candidate_listing_and_product_positions(products_to_match, product_code_indexes_by_manuf, listings_to_match):
+    product_positions_by_index_p = dict(zip(products_to_match['index'], range(len(products_to_match))))
+
+    pairs_by_manuf = {}
+    manufs_in_join_order = []
+    for (listing_position, (pManuf, productDesc, listing_context)) \
+        in enumerate(zip(listings_to_match.pManuf, listings_to_match.productDesc, listings_to_match.listing_context)):
+        if not pManuf in product_code_indexes_by_manuf:
+            continue
+        if not pManuf in pairs_by_manuf:
+            pairs_by_manuf[pManuf] = []
+            manufs_in_join_order.append(pManuf)
+        pairs_by_manuf[pManuf].extend(
+            (listing_position, product_positions_by_index_p[index_p])
+            for index_p in product_code_indexes_by_manuf[pManuf].find_candidates(
+                productDesc, listing_context.product_desc.normalized_text))
+
+    pairs = [pair for manuf in manufs_in_join_order for pair in pairs_by_manuf[manuf]]
+    if len(pairs) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    listing_positions, product_positions = zip(* pairs )
+    return np.array(listing_positions), np.array(product_positions)
 
 # --------------------------------------------------------------------------
 # Find "exact" matches
 # 
-# These have all the alphanumeric characters from manufacturer (optional), family and model
-# in sequence, but with optional whitespace and dashes between every pair of adjacent characters.
+# These have all the alphanumeric characters from family and model in sequence,
+# but with optional whitespace and dashes between every pair of adjacent characters.
 # 
 # The purpose of getting exact matches, is to infer the most likely MegaPixel rating 
 # of the product from the most common MegaPixel rating of these listings.
 # 
-def get_products_and_listings(products, listingsByPManuf):
-    def regex_escape_with_optional_dashes_and_whitespace(text):
-        # Remove all white-space and dashes:
-        escaped_text = re.sub(r'(\s|\-)+', '', text)
-        is_last_char_numeric = len(escaped_text) > 0 and escaped_text[-1].isdigit()
-        # Insert a dash after every character.
-        # Note: this is just a place-holder for where a regex will be inserted later.
-        escaped_text = '-'.join(escaped_text)
-        escaped_text = re.escape(escaped_text)
-        # Replace the "\-" place-holder with a regex sequence matching whitespace characters and/or a single dash:
-        escaped_text = re.sub(r'\\\-', r'\s*(?:\-\s*)?', escaped_text)
-        # Do negative lookbehind to ensure this is not in the middle of a word:
-        escaped_text = r'(?<!\w)' + escaped_text
-        # Do negative lookahead:
-        if is_last_char_numeric:
-            # Don't match a final numeric character if it's followed by a decimal point (or comma) and a number.
-            # This is to prevent issues like a "Casio Exilim EX-Z3 3.2MP Digital Camera" being a match for an "EX-Z33" model.
-            escaped_text = escaped_text + r'(?!\w|\-|\.\d|\,\d)'
-        else:
-            escaped_text = escaped_text + r'(?!\w|\-)'
-        return escaped_text
-    
-    def generate_exact_match_pattern(family, model):
-        fam_and_model = family + model
-        fam_and_model_pattern = regex_escape_with_optional_dashes_and_whitespace(fam_and_model)
-        return fam_and_model_pattern
-    
-    def generate_exact_match_regex_and_pattern(products_row):
-        'Assumption: null/na values in the family column have been converted to empty strings'
-        family = products_row['family']
-        model = products_row['model']
-        pattern = generate_exact_match_pattern( family, model)
-        regex = re.compile( pattern, flags = re.IGNORECASE or re.UNICODE )
-        return regex, pattern
-    
-    regex_pattern_pairs = products.fillna({'family': ''}).apply(generate_exact_match_regex_and_pattern, axis=1)
-    exact_match_regexes, exact_match_patterns = zip(* regex_pattern_pairs )
-    
-    products['exact_match_regex'] = exact_match_regexes
-    products['exact_match_pattern'] = exact_match_patterns
-    
-    # Perform join between products and listings by product:
-    products_to_match = products.reset_index()[['index', 'manufacturer', 'family', 'model', 'exact_match_regex']]
-    listings_to_match_columns \
-        = ['index', 'pManuf', 'productDesc', 'extraProdDetails', 'resolution_in_MP', 'rounded_MP', 'original_listing_index']
-    listings_to_match = listingsByPManuf.reset_index()[listings_to_match_columns]
-    
-    return pd.merge(left=listings_to_match, right=products_to_match, \
-        how='inner', left_on='pManuf', right_on='manufacturer', suffixes=('_l','_p'))
-
-products_and_listings = get_products_and_listings(products, listingsByPManuf)
+# Each listing is scanned once for the family and model of all the products of its manufacturer
+# (see ProductCodeScanner).
+# 
+# Note: The scan is done in the same pass over the products and listings as the matching engines
+#       (see run_matching_engines_on_rows), which sets the is_exact_match column.
+# 
+product_code_scanners_by_manuf = {
+    manuf: ProductCodeScanner(zip(manuf_products.index, manuf_products.family.fillna('') + manuf_products.model))
+    for (manuf, manuf_products) in products.groupby('manufacturer')
+}
+profiler.end_stage(rows_out=len(products))
 
 def get_exact_matches(products_and_listings):
-    def is_exact_match(p_and_l_row):
-        product_desc = p_and_l_row['productDesc']
-        regex = p_and_l_row['exact_match_regex']
-        return regex.search(product_desc) != None
-    
-    products_and_listings['is_exact_match'] = products_and_listings.apply(is_exact_match, axis=1)
     exact_match_columns = ['index_l', 'productDesc', 'resolution_in_MP', 
-        'rounded_MP', 'index_p', 'manufacturer', 'family', 'model']
+        'rounded_MP', 'listing_count', 'index_p', 'manufacturer', 'family', 'model']
     exact_matches = products_and_listings[products_and_listings.is_exact_match][exact_match_columns]
     return exact_matches
 
-exact_matches = get_exact_matches(products_and_listings)
-
 
 # --------------------------------------------------------------------------
 # Determine technical specification (resolution in MP) 
@@ -476,119 +568,291 @@ def setProductResolutionFromExactMatches(products, exact_matches):
     #     75% of listings must share the same resolution (megapixels) for it to become the product's resolution:
     THRESHOLD_PRODUCT_RESOLUTION_RATIO = 0.75
     
-    def analyze_matches(grp):
-        ind_p = grp.iloc[0]['index_p']
-        vc = grp.rounded_MP.value_counts()
-        unique_count = vc.count()
-        
-        if unique_count == 0:
-            product_resolution = np.NaN
-        else:
-            total_count = vc.sum()
-            most_common_count = vc.order(ascending=False).iget_value(0)
-            
-            if (unique_count > 0) and (truediv(most_common_count, total_count) >= THRESHOLD_PRODUCT_RESOLUTION_RATIO):
-                product_resolution = vc.order(ascending=False).index[0]
-            else:
-                product_resolution = np.NaN
-        return ind_p, unique_count, product_resolution
-    
-    exact_match_groups = exact_matches.groupby('index_p')
-    product_resolution_tuples = exact_match_groups.apply(analyze_matches)
-    ind_ps, product_resolution_unique_counts, product_resolutions = zip(* product_resolution_tuples )
+    # Count the listings with each rounded_MP of each product (including those collapsed into the same unique listing):
+    exact_matches_with_MP = exact_matches[exact_matches.rounded_MP.notnull()]
+    listing_counts_by_product_and_MP \
+        = exact_matches_with_MP.groupby(['index_p', 'rounded_MP'])['listing_count'].sum()
+    listing_counts = listing_counts_by_product_and_MP.values
+    MP_index_ps = listing_counts_by_product_and_MP.index.get_level_values(0).values
+    rounded_MPs = listing_counts_by_product_and_MP.index.get_level_values(1).values.astype(float)
     
+    # Get the number of rounded_MPs, and the largest and total listing counts, of each product.
+    # The counts are in order of product, so each product's counts are contiguous.
+    # Note: This uses numpy rather than a groupby on the index_p level, 
+    #       since that calls back into Python for each product in this version of pandas.
+    ind_ps = np.unique(exact_matches.index_p.values)
+    product_positions = np.searchsorted(ind_ps, MP_index_ps)
+    unique_counts = np.zeros(len(ind_ps), dtype=int)
+    total_counts = np.zeros(len(ind_ps))
+    most_common_counts = np.zeros(len(ind_ps))
+    if len(listing_counts) > 0:
+        unique_counts = np.bincount(product_positions, minlength=len(ind_ps))
+        total_counts = np.bincount(product_positions, weights=listing_counts, minlength=len(ind_ps))
+        is_first_of_product = np.concatenate([[True], MP_index_ps[1:] != MP_index_ps[:-1]])
+        most_common_counts[unique_counts > 0] = np.maximum.reduceat(listing_counts, np.flatnonzero(is_first_of_product))
+    
+    # A rounded_MP with at least 75% of the listings has more than all the others combined, 
+    # so at most one rounded_MP per product can pass the threshold:
+    is_product_resolution \
+        = (listing_counts == most_common_counts[product_positions]) \
+        & (most_common_counts[product_positions] / total_counts[product_positions] 
+           >= THRESHOLD_PRODUCT_RESOLUTION_RATIO)
+    product_resolutions = np.empty(len(ind_ps))
+    product_resolutions.fill(np.NaN)
+    product_resolutions[product_positions[is_product_resolution]] = rounded_MPs[is_product_resolution]
+    
+    # Products whose exact matches have no MP ratings have a unique count of zero and no resolution:
     exact_match_df = DataFrame( 
-        { 'resolution_in_MP_unique_count': product_resolution_unique_counts, 
+        { 'resolution_in_MP_unique_count': unique_counts, 
           'product_resolution_in_MP': product_resolutions
         }, index = ind_ps)
 
     products = pd.merge(products, exact_match_df, how='outer', left_index=True, right_index=True)
     return products
 
-products = setProductResolutionFromExactMatches(products, exact_matches)
-
-
-# ==============================================================================
-# Load matching engine and matching rule classes to calculate 
-# highest value matches between products and listings:
-#
-from recordlinker.classification import *
-from recordlinker.builder import *
-
-unique_classifications = products.composite_classification.unique()
-
-
-# ==============================================================================
-# Use the matching engine and matching rule classes to calculate 
-# highest value matches between products and listings:
-#
 
 # -----------------------------------------------------------------------------
-# Generate a master template for each classification:
-master_template_dict = {
-    classification: MasterTemplateBuilder(classification).build() 
-    for classification in unique_classifications 
-}
+# Look up the matching engine of each product (by index_p):
+# 
+# Note: The duplicate products whose matchRule is 'ignore' are given no engine.
+#       Their rows in products_and_listings are kept, since the exact matches include them.
+# 
+matching_engines_by_index_p = products[products.matchRule != 'ignore']['matching_engine'].to_dict()
 
 # -----------------------------------------------------------------------------
-# Generate a matching engine for each product:
+# Run the matching engine for each product and listing combination:
 # 
-def generate_matching_engine(prod_row):
-    classification = prod_row['composite_classification']
-    blocks = prod_row['blocks']
-    family_and_model_len = prod_row['family_and_model_len']
-    master_template = master_template_dict[classification]
-    engine = master_template.generate(blocks, family_and_model_len)
-    return engine
+# The rows are split into chunks, with each manufacturer's rows in separate chunks.
+# If jobs > 1, the chunks are run in a pool of forked processes. The pool is forked once per run,
+# after the matching engines and product code scanners are built, so the workers inherit them from this process.
+# Only the rows of each chunk (and their results) are passed between the processes.
+# The chunks' results are concatenated in order, so they are the same as for a serial run.
+# 
+# The rows for each listing are adjacent, and they share the listing's ListingContext (see get_products_and_listings).
+# It remembers the result of each regex search, so each distinct rule pattern is only searched for once per listing.
+# 
+# The same pass also flags the exact matches, by scanning each listing once for the products of its manufacturer.
+# 
+# Only the highest valued match of each listing is used, so the engines for a listing are run in descending order 
+# of the maximum value they could match with, and the engines which can't beat the best match so far are skipped.
+# 
+# Note: A lower valued match becomes the best match if the best matches are rejected by the megapixel filter 
+#       (see get_best_matches_filtered_by_rounded_MP). So an engine is only skipped if it can't beat 
+#       a match which the filter will never reject: one of the highest type, or to a listing with no megapixel rating.
+#       This gives exactly the same results as running every engine.
+# 
+highest_type_of_match_desc_code = get_match_description_code(
+    BaseMasterTemplateBuilder.all_of_family_and_model_with_regex_desc)
+
+def run_matching_engines_on_rows(engines_and_scanners, rows):
+    engines_by_index_p, scanners_by_manuf = engines_and_scanners
+    product_indexes, pManufs, listing_indexes, listing_contexts, are_listing_MPs_missing = rows
+    start, stop = 0, len(product_indexes)
+    are_exact_matches = np.zeros(stop - start, dtype=bool)
+    are_matches = np.zeros(stop - start, dtype=bool)
+    match_values = np.zeros(stop - start, dtype=np.float64)
+    match_desc_codes = np.zeros(stop - start, dtype=np.int16)
+    if stop <= start:
+        return are_exact_matches, are_matches, match_values, match_desc_codes
+    listing_starts = [start] + list(start + 1 + np.flatnonzero(np.diff(listing_indexes[start:stop]))) + [stop]
+    
+    for (listing_start, listing_stop) in zip(listing_starts[:-1], listing_starts[1:]):
+        listing_context = listing_contexts[listing_start]
+        product_desc = listing_context.product_desc
+        extra_prod_detail = None if listing_context.extra_prod_details is None else listing_context.extra_prod_details.text
+        exactly_matched_index_ps = set(scanners_by_manuf[pManufs[listing_start]].find_products(
+            product_desc.text, product_desc.normalized_text, product_desc.normalized_positions))
+        for row in xrange(listing_start, listing_stop):
+            are_exact_matches[row - start] = product_indexes[row] in exactly_matched_index_ps
+        
+        engines = dict((row, engines_by_index_p[product_indexes[row]]) for row in xrange(listing_start, listing_stop)
+                       if product_indexes[row] in engines_by_index_p)
+        rows = sorted(engines)
+        max_match_values = None
+        if len(rows) > 1:  # a single engine can't be skipped, so there's no need for its maximum value
+            max_match_values = dict((row, engines[row].get_max_match_value(listing_context)) for row in rows)
+            rows.sort(key = lambda row: -max_match_values[row])
+        best_unfilterable_match_value = float('-inf')
+        for row in rows:
+            if max_match_values is not None and max_match_values[row] < best_unfilterable_match_value:
+                break
+            match_result = engines[row].try_match_listing(product_desc.text, extra_prod_detail, listing_context)
+            if match_result.is_match:
+                match_desc_code = match_result.description_code
+                are_matches[row - start] = True
+                match_values[row - start] = match_result.match_value
+                match_desc_codes[row - start] = match_desc_code
+                if are_listing_MPs_missing[row] or match_desc_code == highest_type_of_match_desc_code:
+                    best_unfilterable_match_value = max(best_unfilterable_match_value, match_result.match_value)
+    return are_exact_matches, are_matches, match_values, match_desc_codes
+
+def run_matching_engine_for_all_products_and_listings(products_and_listings, engine_worker_pool):
+    MIN_CHUNK_SIZE = 1000
+    CHUNKS_PER_JOB = 4
+    
+    row_count = len(products_and_listings)
+    max_chunk_size = max(MIN_CHUNK_SIZE, -(-row_count // (engine_worker_pool.jobs * CHUNKS_PER_JOB)))
+    row_ranges = get_row_partitions(products_and_listings['pManuf'].values, max_chunk_size)
+    columns = (
+        products_and_listings['index_p'].values,
+        products_and_listings['pManuf'].values,
+        products_and_listings['index_l'].values,
+        products_and_listings['listing_context'].values,
+        products_and_listings['rounded_MP'].isnull().values
+    )
+    rows_by_chunk = [tuple(column[start:stop] for column in columns) for (start, stop) in row_ranges]
+    match_results_by_chunk = engine_worker_pool.map(rows_by_chunk)
+    del products_and_listings['listing_context']  # the contexts hold each listing's memoized regex search results
+    if len(match_results_by_chunk) > 0:
+        are_exact_matches, are_matches, match_values, match_desc_codes = [
+            np.concatenate(match_result_arrays) for match_result_arrays in zip(*match_results_by_chunk)]
+    else:
+        are_exact_matches = np.zeros(0, dtype=bool)
+        are_matches = np.zeros(0, dtype=bool)
+        match_values = np.zeros(0, dtype=np.float64)
+        match_desc_codes = np.zeros(0, dtype=np.int16)
+    
+    products_and_listings['is_exact_match'] = are_exact_matches
+    products_and_listings['match_result_is_match'] = are_matches
+    products_and_listings['match_result_value'] = match_values
+    products_and_listings['match_result_desc_code'] = match_desc_codes
 
-products['matching_engine'] = products.apply(generate_matching_engine, axis=1)
 
-# -----------------------------------------------------------------------------
-# Add engine to each row of products_and_listings:
+# ==============================================================================
+# Read the listings in chunks and match each chunk of listings to the products:
 # 
-# Note: Ideally this should be done when products_and_listings is created.
-#       However we didn't have the matching engine classes then.
+# Notes:
+#   1. Only compact records are kept from each chunk: the original listing index and unique listing index
+#      of each listing (with a known manufacturer), the megapixel rating and listing count of each unique listing,
+#      the exact matches and the match value and description code of the matched products and listings.
+#      So peak memory depends on the chunk size and the products, rather than the number of listings.
+#   2. The byte offset and length of each listing in the listings file is recorded, 
+#      so that the raw JSON of the matched listings can be copied when the results are written.
+#   3. If a cache folder was given, the parsed listings are read from (or saved to) a cache file there.
+#      So is the cache of the product manufacturer keyword matched to each listing manufacturer.
+#   4. The results are the same for any chunk size. The unique listing indexes run on from one chunk 
+#      to the next, and the listings are re-ordered as if they had been mapped to manufacturers in one chunk.
 # 
-products_and_listings = pd.merge(products_and_listings, \
-    products[products.matchRule != 'ignore'][['matching_engine']], \
-    left_on='index_p', right_index=True, how='inner')
+listingOffsetChunks = []
+listingLengthChunks = []
+listingCount = 0
+uniqueListingCount = 0
+lManufIds = {}  # numbered in order of first appearance in the listings file
+listingsByPManufChunks = []
+uniqueListingMPChunks = []
+uniqueListingCountChunks = []
+exactMatchesChunks = []
+matchedProductsAndListingsChunks = []
+
+pManufKeywordsByLManuf = {}
+if cacheDir is not None:
+    manufCacheFilePath = os.path.join(cacheDir, 'listing_manufacturer_keywords.pickle')
+    manufCacheHeader = {
+        'pManufKeywords': list(pManufKeywords), 
+        'editDistanceThreshold': manufEditDistanceThreshold,
+        'minManufWordLen': minManufWordLen
+    }
+    pManufKeywordsByLManuf = load_pickled_cache(manufCacheFilePath, manufCacheHeader) or {}
+
+engine_worker_pool = ForkedWorkerPool(run_matching_engines_on_rows, 
+    (matching_engines_by_index_p, product_code_scanners_by_manuf), jobs)
+
+for (chunkListingOffsets, chunkListingLengths, chunkListingColumns) \
+        in profiler.iterate_stage('listing input', read_json_line_chunks(listingsFilePath, chunkSize, cacheDir), 
+                                  count_rows = lambda chunk: len(chunk[0])):
+    profiler.start_stage('manufacturer mapping', rows_in=len(chunkListingOffsets))
+    listings = DataFrame(chunkListingColumns).reset_index()
+    listings.rename(columns={'index': 'original_listing_index'}, inplace=True)
+    listings['original_listing_index'] += listingCount
+    listingCount += len(chunkListingOffsets)
+    listingOffsetChunks.append(np.array(chunkListingOffsets, dtype=np.int64))
+    listingLengthChunks.append(np.array(chunkListingLengths, dtype=np.int64))
+    del chunkListingColumns
+    
+    listingsByPManuf = matchListingManufsToProductManufs(listings, pManufsMapping, pManufKeywords, pManufKeywordsByLManuf)
+    profiler.end_stage(rows_out=len(listingsByPManuf))
+    if len(listingsByPManuf) == 0:
+        continue
+    for lManuf in listingsByPManuf.lManuf:
+        lManufIds.setdefault(lManuf, len(lManufIds))
+    listingsByPManuf['lManuf_id'] = [lManufIds[lManuf] for lManuf in listingsByPManuf.lManuf]
+    
+    profiler.start_stage('title splitting', rows_in=len(listingsByPManuf))
+    separatePrimaryAndSecondaryProductInformation(listingsByPManuf)
+    profiler.end_stage(rows_out=len(listingsByPManuf))
+    profiler.start_stage('unique listings', rows_in=len(listingsByPManuf))
+    uniqueListings = getUniqueListings(listingsByPManuf, uniqueListingCount)
+    uniqueListingCount += len(uniqueListings)
+    profiler.end_stage(rows_out=len(uniqueListings))
+    profiler.start_stage('feature extraction', rows_in=len(uniqueListings))
+    extractListingFeatures(uniqueListings)
+    profiler.end_stage(rows_out=len(uniqueListings))
+    
+    profiler.start_stage('candidate generation', rows_in=len(uniqueListings))
+    products_and_listings = get_products_and_listings(uniqueListings, products_to_match, product_code_indexes_by_manuf)
+    profiler.end_stage(rows_out=len(products_and_listings))
+    # The exact matches are flagged in the same pass as the matching engines are run, so they are part of this stage:
+    profiler.start_stage('engine execution', rows_in=len(products_and_listings))
+    run_matching_engine_for_all_products_and_listings(products_and_listings, engine_worker_pool)
+    matched_products_and_listings = products_and_listings[products_and_listings.match_result_is_match]
+    exact_matches = get_exact_matches(products_and_listings)
+    profiler.end_stage(rows_out=len(matched_products_and_listings))
+    
+    listingsByPManufChunks.append(listingsByPManuf[['lManuf_id', 'original_listing_index', 'unique_listing_index']])
+    uniqueListingMPChunks.append(uniqueListings['rounded_MP'].values)
+    uniqueListingCountChunks.append(uniqueListings['listing_count'].values)
+    exactMatchesChunks.append(exact_matches[['index_l', 'index_p', 'rounded_MP', 'listing_count']])
+    matchedProductsAndListingsChunks.append(matched_products_and_listings[['index_l', 'index_p', 
+        'match_result_value', 'match_result_desc_code']])
+
+engine_worker_pool.close()
+
+if cacheDir is not None:
+    save_pickled_cache(manufCacheFilePath, manufCacheHeader, pManufKeywordsByLManuf)
+
+listingOffsets = np.concatenate(listingOffsetChunks)
+listingLengths = np.concatenate(listingLengthChunks)
+listingsByPManuf = pd.concat(listingsByPManufChunks, ignore_index=True).sort_index(
+    by=['lManuf_id', 'original_listing_index'])
+uniqueListingMPs = np.concatenate(uniqueListingMPChunks) if uniqueListingMPChunks else np.zeros(0, dtype=np.float32)
+uniqueListingCounts = np.concatenate(uniqueListingCountChunks) if uniqueListingCountChunks else np.zeros(0, dtype=int)
+exact_matches = pd.concat(exactMatchesChunks, ignore_index=True)
+matched_products_and_listings = pd.concat(matchedProductsAndListingsChunks, ignore_index=True)
+
+profiler.start_stage('product resolution', rows_in=len(exact_matches))
+products = setProductResolutionFromExactMatches(products, exact_matches)
+profiler.end_stage(rows_out=len(products))
 
 # -----------------------------------------------------------------------------
-# Run the matching engine for each product and listing combination:
+# Store the match values and match description codes in a sparse (unique listings x products) matrix:
 # 
-def run_matching_engine_for_all_products_and_listings(products_and_listings):
-    def run_matching_engine(p_and_l_row):
-        product_desc = p_and_l_row['productDesc']
-        extra_prod_details = p_and_l_row['extraProdDetails']
-        engine = p_and_l_row['matching_engine']
-        match_result = engine.try_match_listing(product_desc, extra_prod_details)
-        return match_result
-        # Originally this was returning a tuple, but this didn't work.
-        # Why not? This approach had worked fine elsewhere in the script...
-        # return match_result.is_match, match_result.match_value, match_result.description
-
-    match_results = products_and_listings.apply(run_matching_engine, axis=1)
-
-    products_and_listings['match_result'] = match_results
-    products_and_listings['match_result_is_match'] \
-        = products_and_listings['match_result'].map(lambda mr: mr.is_match)
-    products_and_listings['match_result_value'] \
-        = products_and_listings['match_result'].map(lambda mr: mr.match_value)
-    products_and_listings['match_result_description'] \
-        = products_and_listings['match_result'].map(lambda mr: mr.description)
-
-run_matching_engine_for_all_products_and_listings(products_and_listings)
-matched_products_and_listings = products_and_listings[products_and_listings.match_result_is_match]
+profiler.start_stage('best match selection', rows_in=len(matched_products_and_listings))
+match_scores = MatchScoreMatrix(matched_products_and_listings['index_l'].values, 
+    matched_products_and_listings['index_p'].values, matched_products_and_listings['match_result_value'].values, 
+    matched_products_and_listings['match_result_desc_code'].values, 
+    shape = (uniqueListingCount, products.index.values.max() + 1 if len(products) > 0 else 0))
+del matched_products_and_listings
 
 # -----------------------------------------------------------------------------
 # Find product with highest match value for each listing:
 # 
-def get_highest_value_product_for_listing(listing_grp):
-    by_val = listing_grp.sort_index(by='match_result_value', ascending=False)
-    return by_val.iloc[0]
-
-matches_grouped_by_listing = matched_products_and_listings.groupby('index_l')
-best_matches = matches_grouped_by_listing.apply(get_highest_value_product_for_listing)
+# Note: If matches have the same value, the one with the highest product index is chosen
+#       (see MatchScoreMatrix.get_best_entries).
+# 
+def get_highest_value_product_for_each_listing(match_scores, is_allowed = None):
+    listing_indexes, product_indexes, match_values, match_desc_codes = match_scores.get_best_matches(is_allowed)
+    best_matches = DataFrame({
+            'index_l': listing_indexes,
+            'index_p': product_indexes,
+            'rounded_MP': uniqueListingMPs[listing_indexes],
+            'listing_count': uniqueListingCounts[listing_indexes],
+            'match_result_value': match_values,
+            'match_result_desc_code': match_desc_codes
+        }, index = pd.Index(listing_indexes, name='index_l'))
+    return best_matches
+
+best_matches = get_highest_value_product_for_each_listing(match_scores)
+profiler.end_stage(rows_out=len(best_matches))
 
 best_match_columns = ['index_p', 'manufacturer', 'family', 'model', 'productDesc', \
     'extraProdDetails', 'match_result_value', 'match_result_description']
@@ -603,48 +867,56 @@ best_match_sort_by = ['manufacturer', 'family', 'model', 'productDesc', 'extraPr
 # Estimate the likely Megapixel rating of each product
 # based on the Megapixel ratings of the highest valued matches:
 # 
-def get_products_and_listings_with_rounded_MP_of_best_value_match(best_matches, matched_products_and_listings):
+def get_rounded_MP_of_best_value_match_by_product(best_matches):
     matches_grouped_by_product_mp_and_result_value = best_matches[
         best_matches.rounded_MP.notnull()].groupby(['index_p', 'rounded_MP', 'match_result_value'])
-    matches_by_product_mp_and_result_value_with_counts \
-        = DataFrame({'group_count' : matches_grouped_by_product_mp_and_result_value.size()}).reset_index()
+    matches_by_product_mp_and_result_value_with_counts = DataFrame(
+        {'group_count' : matches_grouped_by_product_mp_and_result_value['listing_count'].sum()}).reset_index()
+        # i.e. the number of listings in each group, since each best match is for a unique listing
 
     THRESHOLD_FOR_REJECTING_MPS_DUE_TO_DIVERSITY = 0.75
+    
+    # Sort the groups of each product by descending value, then descending group count.
+    # Ties are broken by ascending rounded_MP (i.e. the order of the groupby):
+    index_ps = matches_by_product_mp_and_result_value_with_counts['index_p'].values
+    rounded_MPs = matches_by_product_mp_and_result_value_with_counts['rounded_MP'].values.astype(float)
+    match_values = matches_by_product_mp_and_result_value_with_counts['match_result_value'].values
+    group_counts = matches_by_product_mp_and_result_value_with_counts['group_count'].values
+    if len(index_ps) == 0:
+        return Series(rounded_MPs, index = pd.Index(index_ps, name='index_p'))
+    sort_order = np.lexsort((rounded_MPs, -group_counts, -match_values, index_ps))
+    index_ps = index_ps[sort_order]
+    rounded_MPs = rounded_MPs[sort_order]
+    match_values = match_values[sort_order]
+    group_counts = group_counts[sort_order]
+    
+    # The first group of each product is its best valued match:
+    is_first_of_product = np.concatenate([[True], index_ps[1:] != index_ps[:-1]])
+    best_positions = np.flatnonzero(is_first_of_product)
+    product_positions = np.cumsum(is_first_of_product) - 1
+    best_rounded_MPs = rounded_MPs[best_positions]
+    
+    # Count the top-valued groups (i.e. with the same value as the best match) of each product, and their listings.
+    # If there are 2 or more, the second best group is also top-valued, and it is the group after the best group:
+    is_top_valued = match_values == match_values[best_positions][product_positions]
+    count_of_top_valued_MPs = np.bincount(product_positions, weights=is_top_valued)
+    number_of_top_valued_MPs = np.bincount(product_positions, weights=group_counts * is_top_valued)
+    second_best_rounded_MPs = rounded_MPs[np.minimum(best_positions + 1, len(rounded_MPs) - 1)]
+    
+    # Check that the second best rounded_MP is the same (or adjacent), has lower value, 
+    # or has a significantly lower group_count. Else make rounded_MP -1 to signal too much ambiguity:
+    are_top_valued_MPs_diverse = (count_of_top_valued_MPs > 2) | ((count_of_top_valued_MPs == 2) 
+        & (np.abs(second_best_rounded_MPs - best_rounded_MPs) > 1))
+    proportion_of_best_match = group_counts[best_positions] / number_of_top_valued_MPs
+    is_too_ambiguous = are_top_valued_MPs_diverse & (proportion_of_best_match < THRESHOLD_FOR_REJECTING_MPS_DUE_TO_DIVERSITY)
+    # There is too much ambiguity in the Megapixel ratings, suggesting that something is wrong with the product record.
+    # So create an invalid MP rating to ensure that all matches (with MP ratings) are rejected.
+    best_rounded_MPs[is_too_ambiguous] = -1
+    
+    return Series(best_rounded_MPs, index = pd.Index(index_ps[best_positions], name='index_p'))
 
-    def get_rounded_MP_of_best_value_match(grp_by_prod):
-        by_val = grp_by_prod.sort_index(by=['match_result_value','group_count'], ascending=False)
-        # Check that second best rounded_MP is the same, has lower value, or has significantly lower group_count.
-        # Else make rounded_MP -1 to signal too much ambiguity.
-        best_rounded_MP = by_val.iloc[0]['rounded_MP']
-        if by_val['match_result_value'].count() > 1:
-            best_match_result_value = by_val.iloc[0]['match_result_value']
-            second_best_rounded_MP = by_val.iloc[1]['rounded_MP']
-            second_best_match_result_value = by_val.iloc[1]['match_result_value']
-            
-            # Check for multiple top-rated mega-pixel ratings:
-            if second_best_match_result_value == best_match_result_value:
-                count_of_top_valued_MPs \
-                    = by_val[by_val.match_result_value == best_match_result_value]['group_count'].count()
-                if count_of_top_valued_MPs > 2 or abs(second_best_rounded_MP - best_rounded_MP) > 1:
-                    number_of_top_valued_MPs \
-                        = by_val[by_val.match_result_value == best_match_result_value]['group_count'].sum()
-                    best_match_group_count = by_val.iloc[0]['group_count']
-                    proportion_of_best_match = best_match_group_count / number_of_top_valued_MPs
-                    if proportion_of_best_match < THRESHOLD_FOR_REJECTING_MPS_DUE_TO_DIVERSITY:
-                        return -1
-                        # There is too much ambiguity in the Megapixel ratings, 
-                        # suggesting that something is wrong with the product record.
-                        # So create an invalid MP rating to ensure that all matches (with MP ratings) are rejected.
-        return best_rounded_MP
-
-    matches_grouped_by_product = matches_by_product_mp_and_result_value_with_counts.groupby('index_p')
-    best_rounded_MP_by_product = matches_grouped_by_product.apply(get_rounded_MP_of_best_value_match)
-    best_rounded_MP_by_product_DF = DataFrame({'best_value_rounded_MP' : best_rounded_MP_by_product}).reset_index()
-    return pd.merge(matched_products_and_listings, best_rounded_MP_by_product_DF, 
-        left_on='index_p', right_on='index_p', how='left')
-
-matched_products_and_listings \
-    = get_products_and_listings_with_rounded_MP_of_best_value_match(best_matches, matched_products_and_listings)
+profiler.start_stage('megapixel filtering', rows_in=len(best_matches))
+best_rounded_MP_by_product = get_rounded_MP_of_best_value_match_by_product(best_matches)
 
 
 # -----------------------------------------------------------------------------
@@ -652,46 +924,49 @@ matched_products_and_listings \
 # where the listing's rounded megapixel rating matches 
 # the highest valued mega-pixel rating
 #      
-def get_best_matches_filtered_by_rounded_MP(matched_products_and_listings):
-    def get_is_rounded_MP_matched(matched_prod_and_listing):
-        rounded_MP = matched_prod_and_listing['rounded_MP']
-        best_value_rounded_MP = matched_prod_and_listing['best_value_rounded_MP']
-        return abs(rounded_MP - best_value_rounded_MP) <= 1
-
-    are_both_MPS_set = pd.notnull(matched_products_and_listings[
-        ['rounded_MP', 'best_value_rounded_MP']]).all(axis=1)
-    matched_products_and_listings['is_highest_type_of_match'] = \
-        matched_products_and_listings.match_result_description \
-            == BaseMasterTemplateBuilder.all_of_family_and_model_with_regex_desc
-    matched_products_and_listings['is_best_value_rounded_MP_matched'] \
-        = matched_products_and_listings[are_both_MPS_set].apply(get_is_rounded_MP_matched, axis=1)
-    matched_products_and_listings.is_best_value_rounded_MP_matched \
-        = matched_products_and_listings.is_best_value_rounded_MP_matched.fillna(True)
-
-    is_not_filtered_out = matched_products_and_listings[
-        ['is_highest_type_of_match', 'is_best_value_rounded_MP_matched']].any(axis = 1)
-
-    filtered_matched_products_and_listings = matched_products_and_listings[is_not_filtered_out]
-    filtered_matches_grouped_by_listing = filtered_matched_products_and_listings.groupby('index_l')
-    filtered_best_matches = filtered_matches_grouped_by_listing.apply(get_highest_value_product_for_listing)
+# Note: The filter is applied to every entry of the match score matrix at once,
+#       using the megapixel rating of each entry's listing and the best valued megapixel rating of its product.
+# 
+def get_best_matches_filtered_by_rounded_MP(match_scores, best_rounded_MP_by_product):
+    best_value_rounded_MPs = np.empty(match_scores.match_values.shape[1])
+    best_value_rounded_MPs.fill(np.nan)
+    best_value_rounded_MPs[best_rounded_MP_by_product.index.values.astype(int)] = best_rounded_MP_by_product.values
+    
+    rounded_MPs = uniqueListingMPs[match_scores.entry_listing_indexes]
+    best_value_rounded_MPs = best_value_rounded_MPs[match_scores.entry_product_indexes]
+    are_both_MPS_set = ~(np.isnan(rounded_MPs) | np.isnan(best_value_rounded_MPs))
+    is_best_value_rounded_MP_matched = ~are_both_MPS_set
+    is_best_value_rounded_MP_matched[are_both_MPS_set] \
+        = np.abs(rounded_MPs[are_both_MPS_set] - best_value_rounded_MPs[are_both_MPS_set]) <= 1
+    is_highest_type_of_match = match_scores.match_desc_codes.data == get_match_description_code(
+        BaseMasterTemplateBuilder.all_of_family_and_model_with_regex_desc)
+    
+    is_not_filtered_out = is_highest_type_of_match | is_best_value_rounded_MP_matched
+    filtered_best_matches = get_highest_value_product_for_each_listing(match_scores, is_not_filtered_out)
     return filtered_best_matches
 
-filtered_best_matches = get_best_matches_filtered_by_rounded_MP(matched_products_and_listings)
+filtered_best_matches = get_best_matches_filtered_by_rounded_MP(match_scores, best_rounded_MP_by_product)
+profiler.end_stage(rows_out=len(filtered_best_matches))
 
 
 # -----------------------------------------------------------------------------
 # Set matched product on all listings:
 # 
+# Note: The listings which were collapsed into each unique listing are expanded out again here.
+#       A map (rather than a merge) is used to preserve the order of the listings.
+# 
 def get_listings_with_matched_products(listingsByPManuf, filtered_best_matches):
-    filtered_columns = ['index_p', 'index_l']
     filtered_prod_columns = ['family', 'model', 'manufacturer', 'product_name', 'announced-date']
-    listings_with_matched_products = pd.merge( 
-        listingsByPManuf, filtered_best_matches[filtered_columns], how='left', left_index=True, right_on='index_l')
+    listings_with_matched_products = listingsByPManuf.copy()
+    listings_with_matched_products['index_p'] = listings_with_matched_products.unique_listing_index.map(
+        Series(filtered_best_matches['index_p'].values, index=filtered_best_matches['index_l'].values))
     listings_with_matched_products = pd.merge( 
         listings_with_matched_products, products[filtered_prod_columns], how='left', left_on='index_p', right_index=True )
     return listings_with_matched_products
 
+profiler.start_stage('listing expansion', rows_in=len(listingsByPManuf))
 listings_with_matched_products = get_listings_with_matched_products(listingsByPManuf, filtered_best_matches)
+profiler.end_stage(rows_out=len(listings_with_matched_products))
     
 # ==============================================================================
 # Export the resulting matches as a json file:
@@ -700,39 +975,24 @@ listings_with_matched_products = get_listings_with_matched_products(listingsByPM
 # -----------------------------------------------------------------------------
 # Generate result objects:
 # 
-def generate_result_objects(listings_with_matched_products):
-    def generate_json_listings_for_product(prod_grp):
-        original_listing_indices = prod_grp['original_listing_index'].values.tolist()
-        listings = [listingData[oli] for oli in original_listing_indices]
-        return listings
-
-    listings_with_matched_products_by_product_name = listings_with_matched_products.groupby('product_name')
-    listings_by_product_name = listings_with_matched_products_by_product_name.apply(generate_json_listings_for_product)
-    listings_by_product_name_df = DataFrame({'listings' : listings_by_product_name})
-
-    listings_by_all_product_names = pd.merge(
-        products[['product_name']],
-        listings_by_product_name_df,
-        how='left',
-        left_on='product_name',
-        right_index=True
-    ).sort_index(by='product_name')
-
-    def generate_json_product_dict(row):
-        product_name = row['product_name']
-        listings = row['listings']
-        if not (type(listings) is list):
-            listings = []
-        product_dict = {
-            "product_name": product_name,
-            "listings": listings
-        }
-        return json.dumps(product_dict, encoding='utf-8', ensure_ascii=False)
-
-    results = listings_by_all_product_names.apply(generate_json_product_dict, axis=1).values.tolist()
-    return results
-
-results = generate_result_objects(listings_with_matched_products)
+# Notes: 
+#   1. The raw (utf-8 encoded) JSON of each matched listing is copied from a memory map of the listings file, 
+#      using its byte offset and length. So the listings are not re-encoded and keep their original formatting.
+#   2. Each result object is generated as a line of utf-8 encoded JSON.
+#   3. The result objects are generated one at a time in order of product name, 
+#      so that each can be written out before the next is generated.
+# 
+def generate_result_objects(listings_with_matched_products, listingsMap, listingOffsets, listingLengths):
+    original_listing_indices = listings_with_matched_products['original_listing_index'].values
+    listing_positions_by_product_name = listings_with_matched_products.groupby('product_name').indices
+    no_listing_positions = np.zeros(0, dtype=int)
+    
+    for product_name in products['product_name'].order().values:
+        listing_positions = listing_positions_by_product_name.get(product_name, no_listing_positions)
+        listings = [listingsMap.get_raw_record(listingOffsets[oli], listingLengths[oli]) 
+                    for oli in original_listing_indices[listing_positions]]
+        json_product_name = json.dumps(product_name, ensure_ascii=False).encode('utf-8')
+        yield '{"listings": [' + ', '.join(listings) + '], "product_name": ' + json_product_name + '}'
 
 # -----------------------------------------------------------------------------
 # Create output folder:
@@ -743,10 +1003,21 @@ if outputFolderPath != "" and not os.path.exists(outputFolderPath):
     os.makedirs(outputFolderPath)
 
 # -----------------------------------------------------------------------------
-# Write result objects to a file:
+# Write result objects to a file as they are generated:
+#
+# Note: The file is only replaced once all the result objects have been written (see JsonLinesWriter).
 #
-results_file_contents = u'\n'.join(results)
-results_file = codecs.open(outputFilePath, 'w', 'utf-8')
+profiler.start_stage('output', rows_in=len(products))
+with JsonLinesMemoryMap(listingsFilePath) as listingsMap:
+    with JsonLinesWriter(outputFilePath) as results_file:
+        for result_object in generate_result_objects(
+                listings_with_matched_products, listingsMap, listingOffsets, listingLengths):
+            results_file.write_line(result_object)
+profiler.end_stage(rows_out=results_file.line_count)
 
-with results_file as f:
-    f.write(results_file_contents)
+# -----------------------------------------------------------------------------
+# Write the figures of each stage to the profile report (if requested), and print them as a table:
+#
+if profileReportFilePath is not None:
+    profiler.write_json_report(profileReportFilePath)
+    print profiler.format_report_table()
@@ -0,0 +1,86 @@
+# This script measures the memory used by the objects of the recordlinker matching engines:
+#   1. The bytes per matching engine, i.e. the engine with its listing matchers, matching rules and value functions.
+#      Objects shared by many engines (such as the builder's value functions and the interned regexes)
+#      are counted once, and their size is spread across all the engines.
+#   2. The bytes per evaluated product and listing pair, i.e. the size of the MatchResult objects
+#      returned by the engines for every pair (which the pipeline used to keep in a DataFrame column).
+#
+# It accepts an optional command line parameter with the number of engines to generate (the default is 1000).
+# Run it from the python folder e.g. python memory_benchmark.py 1000
+
+import re
+import sys
+from recordlinker.classification import *
+from recordlinker.builder import *
+
+# ----------------------------------------------------------------------
+# Calculate the size of an object and all the objects reachable from it,
+# excluding classes, compiled regexes and any objects already in the seen set:
+#
+def get_deep_size(obj, seen):
+    objects_to_size = [obj]
+    total_size = 0
+    while objects_to_size:
+        obj = objects_to_size.pop()
+        if id(obj) in seen or isinstance(obj, (type, re._pattern_type)):
+            continue
+        seen.add(id(obj))
+        total_size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            objects_to_size.extend(obj.keys())
+            objects_to_size.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            objects_to_size.extend(obj)
+        else:
+            if hasattr(obj, '__dict__'):
+                objects_to_size.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for slot in cls.__dict__.get('__slots__', ()):
+                    if hasattr(obj, slot):
+                        objects_to_size.append(getattr(obj, slot))
+    return total_size
+
+# ----------------------------------------------------------------------
+# Generate engines for a few kinds of product, with a different model number for each engine:
+#
+product_kinds = [
+    # (classification, family blocks, model blocks before the number, title template)
+    ('a-a+a-an', ['Cyber', '-', 'shot'], ['DSC', '-', 'W'], u'Sony Cyber-shot DSC-W%d 12.1 MP Digital Camera'),
+    ('a+an', ['Coolpix'], ['S'], u'Nikon Coolpix S%d 14MP with 5x Zoom'),
+    ('+a-a_n', [], ['V', '-', 'LUX', ' '], u'Leica V-LUX %d (Black)'),
+    ('a+an', ['PowerShot'], ['SD'], u'Canon PowerShot SD%d IS / IXUS')
+]
+
+def generate_engines_and_titles(engine_count):
+    master_templates = {}
+    engines = []
+    titles = []
+    for engine_index in xrange(engine_count):
+        classification, family_blocks, model_blocks, title_template = product_kinds[engine_index % len(product_kinds)]
+        model_number = 100 + engine_index // len(product_kinds)
+        blocks = family_blocks + ['+'] + model_blocks + [str(model_number)]
+        family_and_model_len = len(''.join(blocks)) - 1
+        if classification not in master_templates:
+            master_templates[classification] = MasterTemplateBuilder(classification).build()
+        engines.append(master_templates[classification].generate(blocks, family_and_model_len))
+        titles.append(title_template % model_number)
+    return engines, titles
+
+# ----------------------------------------------------------------------
+# Measure the memory per engine and per evaluated pair:
+#
+engine_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+engines, titles = generate_engines_and_titles(engine_count)
+bytes_per_engine = get_deep_size(engines, set()) / float(engine_count)
+
+listing_titles = titles[:100]
+match_results = [ engine.try_match_listing(title, None) for engine in engines for title in listing_titles ]
+match_count = sum(1 for match_result in match_results if match_result.is_match)
+# Don't count the descriptions, since they are shared with the listing matchers:
+seen = set(id(matcher.match_desc) for engine in engines for matcher in engine.listing_matchers)
+bytes_per_pair = get_deep_size(match_results, seen) / float(len(match_results))
+
+print '| engines | evaluated pairs | matches | bytes per engine | bytes per evaluated pair |'
+print '|---|---|---|---|---|'
+print '| %d | %d | %d | %.0f | %.1f |' % (
+    engine_count, len(match_results), match_count, bytes_per_engine, bytes_per_pair)
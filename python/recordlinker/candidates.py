@@ -0,0 +1,176 @@
+from recordlinker.classification import normalize_match_text, normalize_match_text_with_positions, lower_ascii
+from collections import deque
+import string
+import re
+
+# --------------------------------------------------------------------------------------------------
+# An Aho-Corasick automaton to find all occurrences of a set of patterns in a single pass over a text:
+#
+# Note: Empty patterns are never reported.
+#
+class AhoCorasickAutomaton(object):
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.transitions = [{}]
+        self.outputs = [[]]
+
+        # Build a trie of the patterns:
+        for (pattern_id, pattern) in enumerate(self.patterns):
+            if len(pattern) == 0:
+                continue
+            state = 0
+            for ch in pattern:
+                next_state = self.transitions[state].get(ch)
+                if next_state is None:
+                    next_state = len(self.transitions)
+                    self.transitions[state][ch] = next_state
+                    self.transitions.append({})
+                    self.outputs.append([])
+                state = next_state
+            self.outputs[state].append(pattern_id)
+
+        # Add failure links in breadth-first order, so that the failure state of a parent is always set first:
+        self.failures = [0] * len(self.transitions)
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for (ch, next_state) in self.transitions[state].iteritems():
+                queue.append(next_state)
+                failure = self.failures[state]
+                while failure and not ch in self.transitions[failure]:
+                    failure = self.failures[failure]
+                self.failures[next_state] = self.transitions[failure].get(ch, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.failures[next_state]]
+
+    def find_all(self, text):
+        '''Generates a (pattern_id, end) tuple for every occurrence of a pattern, where end is the index after the match'''
+        transitions = self.transitions
+        failures = self.failures
+        outputs = self.outputs
+        state = 0
+        for (index, ch) in enumerate(text):
+            while state and not ch in transitions[state]:
+                state = failures[state]
+            state = transitions[state].get(ch, 0)
+            for pattern_id in outputs[state]:
+                yield pattern_id, index + 1
+
+# --------------------------------------------------------------------------------------------------
+# An index of the products which a listing could match, used to generate candidate products for a listing.
+#
+# Each product is added with a list of literal groups.
+# A listing is a candidate for the product if all the literals in any one of its groups
+# are found in the listing's normalized text (see normalize_match_text).
+# A product with an empty group (or a group of None) can't be ruled out, so it is a candidate for every listing.
+#
+# All the literals are found with a single scan of the listing's normalized text by an Aho-Corasick automaton.
+# Each group is indexed under its first literal, and is only checked if that literal was found.
+#
+class ProductCodeIndex(object):
+    def __init__(self, literal_groups_by_product):
+        '''literal_groups_by_product is a sequence of (product_key, literal_groups) tuples'''
+        literal_ids = {}
+        self.entries_by_literal_id = []
+        self.unindexed_product_keys = []
+
+        for (product_key, literal_groups) in literal_groups_by_product:
+            for group in literal_groups:
+                group_literals = [literal for literal in group or [] if literal]
+                if len(group_literals) == 0:
+                    self.unindexed_product_keys.append(product_key)
+                    break
+                group_literal_ids = []
+                for literal in group_literals:
+                    if not literal in literal_ids:
+                        literal_ids[literal] = len(literal_ids)
+                        self.entries_by_literal_id.append([])
+                    group_literal_ids.append(literal_ids[literal])
+                self.entries_by_literal_id[group_literal_ids[0]].append((product_key, group_literal_ids))
+
+        literals = sorted(literal_ids, key = lambda literal: literal_ids[literal])
+        self.automaton = AhoCorasickAutomaton(literals)
+
+    def find_candidates(self, text, normalized_text = None):
+        '''Returns the sorted list of keys of the products which text could match.
+        The normalized text can be passed in, if it has already been calculated (e.g. by a ListingText).'''
+        if normalized_text is None:
+            normalized_text = normalize_match_text(text)
+        found_literal_ids = set(literal_id for (literal_id, end) in self.automaton.find_all(normalized_text))
+        candidate_keys = set(self.unindexed_product_keys)
+        for literal_id in found_literal_ids:
+            for (product_key, group_literal_ids) in self.entries_by_literal_id[literal_id]:
+                if all(group_literal_id in found_literal_ids for group_literal_id in group_literal_ids):
+                    candidate_keys.add(product_key)
+        return sorted(candidate_keys)
+
+# --------------------------------------------------------------------------------------------------
+# A scanner to find the products whose code (i.e. family and model) occurs in a text.
+#
+# It gives the same results as searching with each product's exact match regex in turn (see the
+# ExactMatchRegexOracleTestCase in candidates_tests.py for the regex). That is, the characters 
+# of the code must be found in sequence, ignoring the case of ASCII letters, with optional whitespace 
+# and a single optional dash between any two characters. The code must not be preceded by a word character,
+# and must not be followed by a word character or a dash (or by a decimal point or comma and a digit,
+# if the code ends in a digit).
+#
+# The text is scanned once (with whitespace and dashes removed) by an Aho-Corasick automaton,
+# and each occurrence is then mapped back to the original text to check these boundary conditions.
+#
+# Note: Codes which are empty (after removing whitespace and dashes) are never found.
+#
+ascii_word_chars = frozenset(string.ascii_letters + string.digits + '_')
+ascii_digits = frozenset(string.digits)
+class ProductCodeScanner(object):
+    def __init__(self, codes_by_product):
+        '''codes_by_product is a sequence of (product_key, code) tuples'''
+        self.product_keys = []
+        self.is_last_char_numeric = []
+        normalized_codes = []
+        for (product_key, code) in codes_by_product:
+            normalized_code = lower_ascii(re.sub(r'(\s|\-)+', '', code))
+            self.product_keys.append(product_key)
+            self.is_last_char_numeric.append(len(normalized_code) > 0 and normalized_code[-1].isdigit())
+            normalized_codes.append(normalized_code)
+        self.code_lengths = [len(normalized_code) for normalized_code in normalized_codes]
+        self.automaton = AhoCorasickAutomaton(normalized_codes)
+
+    def is_valid_occurrence(self, text, positions, start, end, code_id):
+        text_start = positions[start]
+        text_last = positions[end - 1]
+
+        # Check that the code is not in the middle of a word:
+        if text_start > 0 and text[text_start - 1] in ascii_word_chars:
+            return False
+
+        # Check that there is at most one dash between each pair of adjacent characters:
+        if text_last - text_start != end - 1 - start:
+            for index in xrange(start, end - 1):
+                if text.count('-', positions[index] + 1, positions[index + 1]) > 1:
+                    return False
+
+        # Check what follows the code:
+        if text_last + 1 < len(text):
+            next_char = text[text_last + 1]
+            if next_char in ascii_word_chars or next_char == '-':
+                return False
+            if self.is_last_char_numeric[code_id] and (next_char == '.' or next_char == ',') \
+                and text_last + 2 < len(text) and text[text_last + 2] in ascii_digits:
+                return False
+        return True
+
+    def find_products(self, text, normalized_text = None, positions = None):
+        '''Returns the sorted list of keys of the products whose code occurs in text.
+        The normalized text and its positions (see normalize_match_text_with_positions) can be passed in, 
+        if they have already been calculated (e.g. by a ListingText).'''
+        if text is None:
+            return []
+        if normalized_text is None or positions is None:
+            normalized_text, positions = normalize_match_text_with_positions(text)
+        found_code_ids = set()
+        for (code_id, end) in self.automaton.find_all(normalized_text):
+            if code_id in found_code_ids:
+                continue
+            start = end - self.code_lengths[code_id]
+            if self.is_valid_occurrence(text, positions, start, end, code_id):
+                found_code_ids.add(code_id)
+        return sorted(self.product_keys[code_id] for code_id in found_code_ids)
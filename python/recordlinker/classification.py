@@ -1,12 +1,18 @@
 from abc import ABCMeta, abstractmethod
 import itertools
 import re
+import string
 # from pdb import set_trace
 
 # --------------------------------------------------------------------------------------------------
 # A class to represent the value function for matching a specific number of characters:
 # 
+# Note: The classes of the matching engines use __slots__ (rather than a __dict__ per instance),
+#       since there are many thousands of rules and match results.
+# 
 class MatchValueFunction(object):
+    __slots__ = ('fixed_value', 'value_per_char')
+    
     def __init__(self, fixed_val, val_per_char):
         self.fixed_value = fixed_val
         self.value_per_char = val_per_char
@@ -30,83 +36,217 @@ class MatchValueFunction(object):
         # matching to the shortest applicable product when there are ties.
         # Unfortunately, when there are multiple matching rules, the subtraction will occur multiple times.
         # But since this is only applicable as a tie-breaker, it shouldn't matter.
+    
+    def get_max_value(self, max_chars_matched, family_and_model_len):
+        '''Returns an upper bound on the value of a match of at most max_chars_matched characters'''
+        if max_chars_matched <= 0:
+            return 0.0
+        # The value is linear in the number of characters matched, so its maximum is at 1 or max_chars_matched.
+        # It is multiplied by 10 before a separator, which only increases it if it is positive:
+        max_unscaled_value = max(self.fixed_value + self.value_per_char, 
+                                 self.fixed_value + max_chars_matched * self.value_per_char)
+        if max_unscaled_value > 0:
+            max_unscaled_value = 10 * max_unscaled_value
+        return max(0.0, max_unscaled_value - family_and_model_len)
 
 # --------------------------------------------------------------------------------------------------
 # A class to represent the result of a matching attempt:
 # 
+# The description_code is the code of the description (see get_match_description_code).
+# It is set by the ListingMatcher which matched, so callers storing results in arrays don't need to look it up.
+# 
 class MatchResult(object):
-    def __init__(self, is_matched, match_val = 0, desc = ""):
+    __slots__ = ('is_match', 'match_value', 'description', 'description_code')
+    
+    def __init__(self, is_matched, match_val = 0, desc = "", desc_code = 0):
         self.is_match = is_matched
         self.match_value = match_val
         self.description = desc
+        self.description_code = desc_code
+
+# A single result shared by all failed matches, so that a failed match allocates nothing.
+# Note: Only the results of successful matches are modified (e.g. to add the values of further rules),
+#       so this must never be modified.
+no_match_result = MatchResult(False)
+
+# --------------------------------------------------------------------------------------------------
+# Small integer codes for the descriptions of the ListingMatchers, so that match results can be stored in arrays.
+# Code 0 is the empty description of a failed match.
+# 
+# Note: Each ListingMatcher registers its description when it is created, so that 
+#       worker processes forked after the matching engines are built share the same codes.
+# 
+match_descriptions = ['']
+match_description_codes = { '': 0 }
+
+def get_match_description_code(description):
+    code = match_description_codes.get(description)
+    if code is None:
+        code = len(match_descriptions)
+        match_descriptions.append(description)
+        match_description_codes[description] = code
+    return code
+
+# --------------------------------------------------------------------------------------------------
+# A text of a listing (its product description or extra product details),
+# with the information derived from it which is shared by all the matching rules:
+# 
+#   separator_position: the position of the first separator (i.e. a slash or an open bracket), or None
+#   normalized_text: the text as normalized by normalize_match_text (i.e. without white-space and dashes)
+#   normalized_positions: the position in the text of each character of the normalized text
+# 
+# The normalized text and its positions are only calculated when they are first used 
+# (by the ProductCodeIndex and ProductCodeScanner of the listing's manufacturer).
+# 
+# If memoize_rule_results is set, the span of the first match of each regex is also remembered.
+# Since the rules' regexes are shared (see get_compiled_regex), each distinct pattern is then only
+# searched for once per listing, however many products' rules use it.
+# 
+separator_regex = re.compile('\(|\/', flags = re.UNICODE)
+
+class ListingText(object):
+    def __init__(self, text, memoize_rule_results = False):
+        self.text = text
+        separator_match = separator_regex.search(text)
+        self.separator_position = None if separator_match is None else separator_match.start()
+        self.match_spans_by_regex = {} if memoize_rule_results else None
+        self.__normalized_text = None
+        self.__normalized_positions = None
+    
+    def search(self, regex):
+        '''Returns the (start, end) span of the first match of the regex in the text, or None if there is no match'''
+        if self.match_spans_by_regex is not None and regex in self.match_spans_by_regex:
+            return self.match_spans_by_regex[regex]
+        match_obj = regex.search(self.text)
+        match_span = None if match_obj is None else match_obj.span()
+        if self.match_spans_by_regex is not None:
+            self.match_spans_by_regex[regex] = match_span
+        return match_span
+    
+    @property
+    def normalized_text(self):
+        if self.__normalized_text is None:
+            self.__normalized_text = normalize_match_text(self.text)
+        return self.__normalized_text
+    
+    @property
+    def normalized_positions(self):
+        if self.__normalized_positions is None:
+            self.__normalized_positions = get_normalized_positions(self.text)
+        return self.__normalized_positions
+
+# --------------------------------------------------------------------------------------------------
+# The texts of a listing, which are shared by all the rules of all the products matched to the listing,
+# so that the work which only depends on the listing is done once per listing rather than once per rule:
+# 
+class ListingContext(object):
+    def __init__(self, product_desc, extra_prod_details = None, memoize_rule_results = False):
+        self.product_desc = ListingText(product_desc, memoize_rule_results)
+        self.extra_prod_details = None if extra_prod_details is None \
+            else ListingText(extra_prod_details, memoize_rule_results)
 
 # --------------------------------------------------------------------------------------------------
 # Matching rules for a given product to test whether a listing matches that product:
 # 
 class MatchingRule(object):
+    # The normalized text (see normalize_match_text) which must be found in a listing for the rule to match,
+    # if known, and whether it must be found in the product description (rather than the extra product details):
+    match_literal = None
+    must_match_on_product_desc = False
+    __slots__ = ()
+    
+    @abstractmethod
+    def try_match(self, product_desc, extra_prod_details = None, listing_context = None):
+        pass
+    
     @abstractmethod
-    def try_match(self, product_desc, extra_prod_details = None):
+    def get_max_match_value(self, listing_context):
+        '''Returns an upper bound on the value of a match of this rule to the listing'''
         pass
 
 # --------------------------------------------------------------------------------------------------
 # A match rule class which uses a regular expression to test for a match:
 # 
 class RegexMatchingRule(MatchingRule):
-    def __init__(self, regex, fam_and_model_len, value_func_on_desc, value_func_on_details, must_match_on_desc = False):
+    __slots__ = ('family_and_model_len', 'match_regex', 'value_func_on_product_desc', 'value_func_on_extra_prod_details',
+                 'must_match_on_product_desc', 'match_literal')
+    
+    def __init__(self, regex, fam_and_model_len, value_func_on_desc, value_func_on_details, must_match_on_desc = False, 
+                 literal = None):
         self.family_and_model_len = fam_and_model_len
         self.match_regex = regex
         self.value_func_on_product_desc = value_func_on_desc
         self.value_func_on_extra_prod_details = value_func_on_details
         self.must_match_on_product_desc = must_match_on_desc  # this will be set for the mandatory match only
+        self.match_literal = literal
     
-    def __try_match_text(self, text_to_match, match_value_func):
-        match_obj = self.match_regex.search(text_to_match)
-        if match_obj is None:
-            return MatchResult(False)
-        chars_matched = match_obj.end() - match_obj.start()
+    def __try_match_text(self, listing_text, match_value_func):
+        match_span = listing_text.search(self.match_regex)
+        if match_span is None:
+            return no_match_result
+        match_start, match_end = match_span
+        chars_matched = match_end - match_start
         
         # Make the match more valuable if it occurs before the first separator 
         # (i.e. a slash or an open bracket) in the text to match.
         # This ensures that, if the listing contains alternate product codes/names 
         # in brackets or after a slash, that the first product code is more likely to be matched:
-        sep_mr = re.search('\(|\/', text_to_match, flags = re.UNICODE )
-        is_after_sep = sep_mr != None and sep_mr.start() < match_obj.start()
+        sep_position = listing_text.separator_position
+        is_after_sep = sep_position != None and sep_position < match_start
         match_value = match_value_func.evaluate(chars_matched, self.family_and_model_len, is_after_sep)
         
         return MatchResult(True, match_value)
     
-    def try_match(self, product_desc, extra_prod_details = None):
+    def try_match(self, product_desc, extra_prod_details = None, listing_context = None):
+        if listing_context is None:
+            listing_context = ListingContext(product_desc, extra_prod_details)
         match_result = RegexMatchingRule.__try_match_text(
-            self, product_desc, self.value_func_on_product_desc)
+            self, listing_context.product_desc, self.value_func_on_product_desc)
         if self.must_match_on_product_desc and not match_result.is_match:
             return match_result
-        if self.value_func_on_extra_prod_details.is_assigned() and extra_prod_details != None:
+        if self.value_func_on_extra_prod_details.is_assigned() and listing_context.extra_prod_details != None:
             extra_details_match_result = RegexMatchingRule.__try_match_text(
-                self, extra_prod_details, self.value_func_on_extra_prod_details)
+                self, listing_context.extra_prod_details, self.value_func_on_extra_prod_details)
             if not match_result.is_match:
                 return extra_details_match_result
             if extra_details_match_result.is_match:
                 match_result.match_value = match_result.match_value + extra_details_match_result.match_value
         return match_result
+    
+    def get_max_match_value(self, listing_context):
+        # No more characters can be matched than there are in each text:
+        max_value = self.value_func_on_product_desc.get_max_value(
+            len(listing_context.product_desc.text), self.family_and_model_len)
+        if self.value_func_on_extra_prod_details.is_assigned() and listing_context.extra_prod_details != None:
+            max_value_on_details = self.value_func_on_extra_prod_details.get_max_value(
+                len(listing_context.extra_prod_details.text), self.family_and_model_len)
+            if self.must_match_on_product_desc:
+                max_value = max(max_value, max_value + max_value_on_details)
+            else:
+                max_value = max(max_value, max_value_on_details, max_value + max_value_on_details)
+        return max_value
 
 # --------------------------------------------------------------------------------------------------
 # A class which uses a set of mandatory and optional matching rules to try to match a listing:
 # 
 class ListingMatcher(object):
+    __slots__ = ('match_desc', 'match_desc_code', 'mandatory_matching_rules', 'optional_matching_rules')
+    
     def __init__(self, description, mandatory_rules, optional_rules):
         self.match_desc = description
+        self.match_desc_code = get_match_description_code(description)
         self.mandatory_matching_rules = mandatory_rules
         self.optional_matching_rules = optional_rules
     
-    def try_match(self, product_desc, extra_prod_details):
+    def try_match(self, product_desc, extra_prod_details, listing_context = None):
         # There must be at least one mandatory rule:
         if len(self.mandatory_matching_rules) == 0:
-            return MatchResult(False)
+            return no_match_result
             
         is_first_rule = True
         
         for mandatory_rule in self.mandatory_matching_rules:
-            mandatory_match_result = mandatory_rule.try_match(product_desc, extra_prod_details)
+            mandatory_match_result = mandatory_rule.try_match(product_desc, extra_prod_details, listing_context)
             if mandatory_match_result.is_match:
                 if is_first_rule:
                     final_match_result = mandatory_match_result
@@ -114,30 +254,118 @@ class ListingMatcher(object):
                 else:
                     final_match_result.match_value = final_match_result.match_value + mandatory_match_result.match_value
             else:
-                return MatchResult(False)
+                return no_match_result
         
         final_match_result.description = self.match_desc
+        final_match_result.description_code = self.match_desc_code
         
         for optional_rule in self.optional_matching_rules:
-            optional_match_result = optional_rule.try_match(product_desc, extra_prod_details)
+            optional_match_result = optional_rule.try_match(product_desc, extra_prod_details, listing_context)
             if optional_match_result.is_match:
                 final_match_result.match_value = final_match_result.match_value + optional_match_result.match_value
         
         return final_match_result
+    
+    def get_max_match_value(self, listing_context):
+        if len(self.mandatory_matching_rules) == 0:
+            return float('-inf')
+        max_value = sum(rule.get_max_match_value(listing_context) for rule in self.mandatory_matching_rules)
+        for optional_rule in self.optional_matching_rules:
+            max_value = max_value + max(0, optional_rule.get_max_match_value(listing_context))
+        return max_value
+    
+    def get_required_literals(self):
+        # The literals which must all be found in the normalized product description for this matcher to match.
+        # Rules which can be satisfied by the extra product details (or which have no literal) are left out:
+        return [ rule.match_literal
+                 for rule in self.mandatory_matching_rules
+                 if rule.must_match_on_product_desc and rule.match_literal
+               ]
 
 # --------------------------------------------------------------------------------------------------
 # Matching engine to run through the ListingMatchers for a product, 
 # and find the first one which applies to a particular listing:
+# 
+# A ListingContext for the listing can be passed in, so that it can be shared with the engines of other products.
+# Otherwise one is created, with memoize_rule_results determining whether it remembers the results of regex searches.
+# 
 class MatchingEngine(object):
+    __slots__ = ('listing_matchers',)
+    
     def __init__(self, matchers):
         self.listing_matchers = matchers
     
-    def try_match_listing(self, product_desc, extra_product_details):
+    def try_match_listing(self, product_desc, extra_product_details, listing_context = None, 
+                          memoize_rule_results = False):
+        if listing_context is None:
+            listing_context = ListingContext(product_desc, extra_product_details, memoize_rule_results)
         for matcher in self.listing_matchers:
-            match_result = matcher.try_match(product_desc, extra_product_details)
+            match_result = matcher.try_match(product_desc, extra_product_details, listing_context)
             if match_result.is_match:
                 return match_result
-        return MatchResult(False)
+        return no_match_result
+    
+    def get_max_match_value(self, listing_context):
+        '''Returns an upper bound on the value of any match of the listing (or -inf if it can't be matched).
+        This allows a caller looking for the highest valued match to skip engines which can't beat it.'''
+        return max([matcher.get_max_match_value(listing_context) for matcher in self.listing_matchers] 
+                   + [float('-inf')])
+    
+    def get_required_literal_groups(self):
+        # One list of required literals per listing matcher.
+        # An empty list means the matcher can't be ruled out by searching for literals:
+        return [matcher.get_required_literals() for matcher in self.listing_matchers]
+
+
+# --------------------------------------------------------------------------------------------------
+# Normalize text for literal (non-regex) searches by lower-casing it and removing all white-space and dashes.
+# This mirrors the optional whitespace and dash sequence which RegexRuleTemplate inserts between characters,
+# so a listing can only match a rule if the rule's normalized text is found in the listing's normalized text.
+# 
+# The rules' regexes (and the exact match codes) use re.IGNORECASE without re.UNICODE, so only ASCII letters 
+# are lower-cased and only ASCII white-space is removed, in the same way.
+# 
+# get_normalized_positions gives the position in the text of each character of the normalized text
+# (and normalize_match_text_with_positions gives both).
+# 
+whitespace_and_dashes_regex = re.compile('(\s|\-)+')
+non_whitespace_or_dash_regex = re.compile('[^\s\-]')
+ascii_lower_case_table = dict((ord(ch), ord(ch.lower())) for ch in string.ascii_uppercase)
+
+def lower_ascii(text):
+    if isinstance(text, unicode):
+        return text.translate(ascii_lower_case_table)
+    return text.lower()
+
+def normalize_match_text(text):
+    if text is None:
+        return ''
+    return lower_ascii(whitespace_and_dashes_regex.sub('', text))
+
+def get_normalized_positions(text):
+    return [ char_match.start() for char_match in non_whitespace_or_dash_regex.finditer(text) ]
+
+def normalize_match_text_with_positions(text):
+    positions = get_normalized_positions(text)
+    return lower_ascii(''.join([ text[position] for position in positions ])), positions
+
+
+# --------------------------------------------------------------------------------------------------
+# A process-wide cache of compiled regular expressions, keyed by pattern and flags.
+# 
+# Many products share the same rule texts (e.g. the family "Cyber-shot", or "IS" and "HD"),
+# so each distinct pattern is only compiled once, and the compiled regex is shared by all the rules using it.
+# Unlike the re module's own cache, this is never cleared, so the same regex object is always returned.
+# 
+compiled_regexes_by_pattern_and_flags = {}
+
+def get_compiled_regex(pattern, flags = 0):
+    key = (type(pattern), pattern, flags)
+    regex = compiled_regexes_by_pattern_and_flags.get(key)
+    if regex is None:
+        regex = re.compile(pattern, flags)
+        compiled_regexes_by_pattern_and_flags[key] = regex
+    return regex
 
 
 # --------------------------------------------------------------------------------------------------
@@ -172,9 +400,10 @@ class RegexRuleBaseTemplate(MatchingRuleTemplate):
         extracted_blocks = itertools.chain.from_iterable(block_gen)
         extracted_text = ''.join(extracted_blocks)
         pattern = self.generate_regex_pattern(extracted_text)
-        regex = re.compile(pattern, flags = re.IGNORECASE or re.UNICODE )
+        regex = get_compiled_regex(pattern, flags = re.IGNORECASE or re.UNICODE )
+        literal = normalize_match_text(extracted_text)
         return RegexMatchingRule(regex, family_and_model_len, self.value_func_on_product_desc,
-            self.value_func_on_extra_prod_details, self.must_match_on_product_desc)
+            self.value_func_on_extra_prod_details, self.must_match_on_product_desc, literal)
 
 # --------------------------------------------------------------------------------------------------
 # A class to represent the template for a RegexMatchingRule:
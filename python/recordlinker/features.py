@@ -0,0 +1,108 @@
+import re
+import numpy as np
+from math import floor
+
+# --------------------------------------------------------------------------------------------------
+# Technical specifications which can be extracted from the product description of a listing:
+#
+#   megapixels: the resolution (e.g. "12.1 MP", "14 Megapixels" or "10,1 Mio. Pixel")
+#   optical_zoom: the zoom factor (e.g. "5x" or "3.8 X")
+#   screen_size: the screen size in inches (e.g. "3.0-Inch", "2.7 inches" or '3"')
+#
+# Each feature is a number followed by the pattern of its unit.
+# The megapixel pattern is the one which the script has always used, so that the same ratings are found.
+# Zoom and screen size must start at the beginning of a word (e.g. the "40" of "D40X" is not a zoom factor).
+#
+number_pattern = r'\d+(?:[.,]\d+)?'
+megapixels_unit_pattern = r'''\s*(?:\-\s*)?(?:MP|MPixe?l?s?|(?:(?:mega?|mio\.?)(?:|\-|\s+)pix?e?l?s?))(?:$|\W)'''
+optical_zoom_unit_pattern = r'''\s*x(?:$|\W)'''
+screen_size_unit_pattern = r'''\s*(?:\-\s*)?(?:inch(?:es)?(?:$|\W)|in\.|"|'')'''
+word_start_pattern = r'(?<![\w.,])'
+
+# The pattern of each feature on its own (to be used with re.IGNORECASE), with its number in a named group:
+megapixels_pattern = r'(?P<megapixels>%s)%s' % (number_pattern, megapixels_unit_pattern)
+optical_zoom_pattern = word_start_pattern + r'(?P<optical_zoom>%s)%s' % (number_pattern, optical_zoom_unit_pattern)
+screen_size_pattern = word_start_pattern + r'(?P<screen_size>%s)%s' % (number_pattern, screen_size_unit_pattern)
+
+# --------------------------------------------------------------------------------------------------
+# A regex to find all the features in a single pass over a product description:
+#
+# Each match is of a single feature, and the name of the feature is the match's lastgroup. 
+# Its number starts at the start of the match and ends at the end of the named group.
+# The texts of two different features can't overlap, since each number is directly followed by its unit, 
+# and the units of the features start with different characters. So no feature is hidden by 
+# the text of another one, and the first match of each feature is its first occurrence.
+#
+# Every feature starts with a digit, so the regex starts with the first digit of the number. 
+# This lets the regex engine skip quickly from one digit to the next, but only without re.IGNORECASE,
+# so the units ignore the case of ASCII letters with character sets instead (see ignore_ascii_case).
+# The word start check of the optical zoom and screen size is done after the first digit,
+# so it looks back one more character.
+#
+# Note: Like the script's original megapixel search, this doesn't use re.UNICODE,
+#       so \d and \W only treat ASCII characters as digits and word characters.
+#
+ascii_letter_or_escape_regex = re.compile(r'\\.|([a-zA-Z])')
+
+def ignore_ascii_case(pattern):
+    '''Replaces each ASCII letter (outside an escape sequence) with a set of its lower and upper case'''
+    return ascii_letter_or_escape_regex.sub(
+        lambda match: match.group(0) if match.group(1) is None else '[%s%s]' % (match.group(1).lower(), match.group(1).upper()),
+        pattern)
+
+rest_of_number_pattern = r'\d*(?:[.,]\d+)?'
+
+feature_regex = re.compile(
+    r'\d(?:(?P<megapixels>%s)%s|(?<![\w.,]\d)(?:(?P<optical_zoom>%s)%s|(?P<screen_size>%s)%s))' % (
+        rest_of_number_pattern, ignore_ascii_case(megapixels_unit_pattern),
+        rest_of_number_pattern, ignore_ascii_case(optical_zoom_unit_pattern),
+        rest_of_number_pattern, ignore_ascii_case(screen_size_unit_pattern)))
+
+def parse_feature_number(number_text):
+    return float(number_text.replace(',', '.'))
+
+# --------------------------------------------------------------------------------------------------
+# The features of a set of listings, as float32 arrays in the order of the listings,
+# with NaN where a listing's product description doesn't mention the feature:
+#
+# rounded_megapixels is the megapixels rounded down to a whole number.
+# It is rounded before converting the megapixels to float32, so that the rounding is not affected
+# by the lower precision (and a whole number of megapixels is represented exactly as a float32).
+#
+class ListingFeatures(object):
+    def __init__(self, listing_count):
+        self.megapixels = np.empty(listing_count, dtype=np.float32)
+        self.megapixels.fill(np.nan)
+        self.rounded_megapixels = self.megapixels.copy()
+        self.optical_zoom = self.megapixels.copy()
+        self.screen_size = self.megapixels.copy()
+
+# --------------------------------------------------------------------------------------------------
+# Extract the features of each of the product descriptions,
+# using the first occurrence of each feature in the description:
+#
+def extract_listing_features(product_descs):
+    features = ListingFeatures(len(product_descs))
+    megapixels = features.megapixels
+    rounded_megapixels = features.rounded_megapixels
+    optical_zoom = features.optical_zoom
+    screen_size = features.screen_size
+
+    for (listing_index, product_desc) in enumerate(product_descs):
+        found_feature_names = []
+        for feature_match in feature_regex.finditer(product_desc):
+            feature_name = feature_match.lastgroup
+            if feature_name in found_feature_names:
+                continue
+            found_feature_names.append(feature_name)
+            value = parse_feature_number(product_desc[feature_match.start():feature_match.end(feature_name)])
+            if feature_name == 'megapixels':
+                megapixels[listing_index] = value
+                rounded_megapixels[listing_index] = floor(value)
+            elif feature_name == 'optical_zoom':
+                optical_zoom[listing_index] = value
+            else:
+                screen_size[listing_index] = value
+            if len(found_feature_names) == 3:
+                break
+    return features
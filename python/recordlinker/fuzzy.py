@@ -0,0 +1,72 @@
+# --------------------------------------------------------------------------------------------------
+# Calculate the Levenshtein distance between two strings
+# (i.e. the number of character insertions, deletions and substitutions to change one into the other).
+#
+# If max_distance is given, the calculation stops early once the distance must exceed max_distance,
+# and max_distance + 1 is returned instead.
+#
+def levenshtein_distance(text1, text2, max_distance = None):
+    if len(text1) < len(text2):
+        text1, text2 = text2, text1
+    if max_distance is not None and len(text1) - len(text2) > max_distance:
+        return max_distance + 1
+
+    previous_row = range(len(text2) + 1)
+    for (index1, char1) in enumerate(text1):
+        current_row = [index1 + 1]
+        for (index2, char2) in enumerate(text2):
+            current_row.append(min(
+                previous_row[index2 + 1] + 1,              # deletion
+                current_row[index2] + 1,                   # insertion
+                previous_row[index2] + (char1 != char2)    # substitution
+            ))
+        if max_distance is not None and min(current_row) > max_distance:
+            return max_distance + 1
+        previous_row = current_row
+    return previous_row[-1]
+
+# --------------------------------------------------------------------------------------------------
+# A BK-tree of words, to find the words within a given Levenshtein distance of a word
+# without calculating the distance to every word.
+#
+# Each child of a node is keyed by its distance from the node. By the triangle inequality,
+# only the children whose key is within max_distance of the query word's distance from the node
+# can contain matches.
+#
+# The words are identified by their position in the list passed to the constructor.
+#
+class BKTree(object):
+    def __init__(self, words):
+        self.root = None
+        for (word_id, word) in enumerate(words):
+            self.add(word, word_id)
+
+    def add(self, word, word_id):
+        if self.root is None:
+            self.root = (word, [word_id], {})
+            return
+        node = self.root
+        while True:
+            node_word, node_word_ids, children = node
+            distance = levenshtein_distance(word, node_word)
+            if distance == 0:
+                node_word_ids.append(word_id)
+                return
+            if not distance in children:
+                children[distance] = (word, [word_id], {})
+                return
+            node = children[distance]
+
+    def find_within(self, word, max_distance):
+        '''Returns the sorted ids of the words within max_distance of word'''
+        found_word_ids = []
+        nodes_to_search = [self.root] if self.root is not None else []
+        while nodes_to_search:
+            node_word, node_word_ids, children = nodes_to_search.pop()
+            distance = levenshtein_distance(word, node_word)
+            if distance <= max_distance:
+                found_word_ids.extend(node_word_ids)
+            for (child_distance, child) in children.iteritems():
+                if abs(child_distance - distance) <= max_distance:
+                    nodes_to_search.append(child)
+        return sorted(found_word_ids)
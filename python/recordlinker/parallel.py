@@ -0,0 +1,78 @@
+from multiprocessing import Pool
+import os
+
+# --------------------------------------------------------------------------------------------------
+# Split a sequence of rows into contiguous (start, stop) ranges of at most max_chunk_size rows.
+# A new range is always started when the partition key changes (e.g. at a new manufacturer):
+#
+def get_row_partitions(partition_keys, max_chunk_size):
+    partitions = []
+    start = 0
+    previous_key = None
+    for (row, key) in enumerate(partition_keys):
+        if row > start and (key != previous_key or row - start >= max_chunk_size):
+            partitions.append((start, row))
+            start = row
+        previous_key = key
+    if len(partition_keys) > start:
+        partitions.append((start, len(partition_keys)))
+    return partitions
+
+# --------------------------------------------------------------------------------------------------
+# A pool of forked worker processes to run a function over lists of tasks.
+#
+# The function is called as func(shared_args, task) and must return a picklable result.
+# The function and its shared arguments (such as the matching engines) are not pickled.
+# Instead they are stored in a global variable before the workers are forked, so the workers
+# inherit them from the parent process (copy-on-write). Only the tasks and results are pickled.
+#
+# The workers are forked once, when the pool is created, and are reused by each call to map
+# until the pool is closed. So the pool should be created once the shared arguments are built,
+# and each task should carry the data which changes between calls (e.g. a chunk of listings).
+#
+# The results of map are returned in the same order as the tasks, so the output is deterministic.
+# The tasks are run serially in the current process if jobs is 1
+# or if the platform can't fork processes (e.g. Windows).
+#
+# Note: Only one pool can be open at a time, since the workers get the function from a global variable.
+#
+forked_function_and_shared_args = None
+
+def is_fork_available():
+    return hasattr(os, 'fork')
+
+def run_forked_task(task):
+    func, shared_args = forked_function_and_shared_args
+    return func(shared_args, task)
+
+class ForkedWorkerPool(object):
+    def __init__(self, func, shared_args, jobs):
+        global forked_function_and_shared_args
+        if jobs < 1:
+            raise ValueError('The number of jobs must be at least 1, not %r' % jobs)
+        self.func = func
+        self.shared_args = shared_args
+        self.jobs = jobs
+        self.pool = None
+        if jobs > 1 and is_fork_available():
+            forked_function_and_shared_args = (func, shared_args)
+            self.pool = Pool(processes = jobs)
+
+    def map(self, tasks):
+        if self.pool is None or len(tasks) <= 1:
+            return [self.func(self.shared_args, task) for task in tasks]
+        return self.pool.map(run_forked_task, tasks, chunksize = 1)
+
+    def close(self):
+        global forked_function_and_shared_args
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+            forked_function_and_shared_args = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,163 @@
+import json
+import os
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    resource = None  # e.g. on Windows, where the memory figures are not available
+
+# --------------------------------------------------------------------------------------------------
+# The figures of a named stage of a pipeline:
+#
+#   run_count: the number of times the stage was run (e.g. once per chunk of listings)
+#   wall_time and cpu_time: the elapsed and CPU seconds of all the runs of the stage
+#   peak_memory_increase_in_MB: how much the stage raised the peak memory of the process, or None if not known
+#   rows_in and rows_out: the total number of rows passed into and out of the stage, or None if not given
+#
+# The CPU time includes the time of any child processes which finished during the stage (e.g. forked workers).
+#
+# The peak memory is the maximum resident set size of the process, so it never decreases. A stage which only
+# reuses memory freed by earlier stages has no increase, and the increases of all the stages add up to
+# the peak memory of the pipeline (less the memory already in use before the first stage).
+#
+class StageFigures(object):
+    def __init__(self, name):
+        self.name = name
+        self.run_count = 0
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_memory_increase_in_MB = None if resource is None else 0.0
+        self.rows_in = None
+        self.rows_out = None
+
+    def add_rows(self, rows_in = None, rows_out = None):
+        if rows_in is not None:
+            self.rows_in = (self.rows_in or 0) + rows_in
+        if rows_out is not None:
+            self.rows_out = (self.rows_out or 0) + rows_out
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'run_count': self.run_count,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'peak_memory_increase_in_MB': self.peak_memory_increase_in_MB,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out
+        }
+
+def get_cpu_time():
+    # The user and system time of this process and its finished child processes:
+    return sum(os.times()[:4])
+
+def get_peak_memory_in_MB():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux (but in bytes on Mac OS X):
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else max_rss / 1024.0
+
+# --------------------------------------------------------------------------------------------------
+# A registry of the stages of a pipeline, which measures the figures of each stage (see StageFigures):
+#
+# A stage is measured from start_stage until end_stage (or until the next stage is started),
+# so only one stage is measured at a time. This allows the stages of a flat script to be marked
+# without moving its code into blocks. The code between an end_stage and the next start_stage is not measured.
+#
+# A stage which is run more than once has its figures added together, so there is one entry per stage name,
+# in the order in which the stages were first started.
+#
+# iterate_stage measures the time spent getting the items of an iterable (such as the chunks of a file)
+# as a stage of its own, even though the items are used by other stages in between.
+#
+class StageProfiler(object):
+    def __init__(self):
+        self.stages = []
+        self.stages_by_name = {}
+        self.current_stage = None
+        self.start_wall_time = time.time()
+        self.start_cpu_time = get_cpu_time()
+        self.start_peak_memory_in_MB = get_peak_memory_in_MB()
+
+    def start_stage(self, name, rows_in = None):
+        self.end_stage()
+        if name not in self.stages_by_name:
+            self.stages_by_name[name] = StageFigures(name)
+            self.stages.append(self.stages_by_name[name])
+        self.current_stage = self.stages_by_name[name]
+        self.current_stage.add_rows(rows_in = rows_in)
+        self.stage_start_wall_time = time.time()
+        self.stage_start_cpu_time = get_cpu_time()
+        self.stage_start_peak_memory_in_MB = get_peak_memory_in_MB()
+
+    def end_stage(self, rows_out = None):
+        stage = self.current_stage
+        if stage is None:
+            return
+        stage.run_count += 1
+        stage.wall_time += time.time() - self.stage_start_wall_time
+        stage.cpu_time += get_cpu_time() - self.stage_start_cpu_time
+        if stage.peak_memory_increase_in_MB is not None:
+            stage.peak_memory_increase_in_MB += get_peak_memory_in_MB() - self.stage_start_peak_memory_in_MB
+        stage.add_rows(rows_out = rows_out)
+        self.current_stage = None
+
+    def iterate_stage(self, name, iterable, count_rows = None):
+        '''Generates the items of the iterable, measuring the time to get each item as the named stage.
+        If count_rows is given, it is called with each item to get the number of rows out of the stage.'''
+        iterator = iter(iterable)
+        while True:
+            self.start_stage(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.end_stage()
+                return
+            self.end_stage(rows_out = None if count_rows is None else count_rows(item))
+            yield item
+
+    def get_report(self):
+        '''Returns the figures of the stages and of the whole pipeline so far, as a dictionary'''
+        self.end_stage()
+        peak_memory_in_MB = get_peak_memory_in_MB()
+        return {
+            'stages': [ stage.to_dict() for stage in self.stages ],
+            'total': {
+                'wall_time': time.time() - self.start_wall_time,
+                'cpu_time': get_cpu_time() - self.start_cpu_time,
+                'peak_memory_in_MB': peak_memory_in_MB,
+                'peak_memory_increase_in_MB': None if peak_memory_in_MB is None
+                    else peak_memory_in_MB - self.start_peak_memory_in_MB
+            }
+        }
+
+    def write_json_report(self, file_path):
+        with open(file_path, 'wb') as report_file:
+            json.dump(self.get_report(), report_file, indent = 2, sort_keys = True)
+
+    def format_report_table(self):
+        '''Returns the figures of the stages as a human-readable table, with a total row at the bottom'''
+        report = self.get_report()
+        def format_value(value, format_string):
+            return '-' if value is None else format_string % value
+        header = ('stage', 'runs', 'wall (s)', 'cpu (s)', 'peak mem +MB', 'rows in', 'rows out')
+        rows = [ (stage['name'], str(stage['run_count']),
+                  format_value(stage['wall_time'], '%.3f'), format_value(stage['cpu_time'], '%.3f'),
+                  format_value(stage['peak_memory_increase_in_MB'], '%.1f'),
+                  format_value(stage['rows_in'], '%d'), format_value(stage['rows_out'], '%d'))
+                 for stage in report['stages'] ]
+        total = report['total']
+        rows.append(('total', '', format_value(total['wall_time'], '%.3f'), format_value(total['cpu_time'], '%.3f'),
+                     format_value(total['peak_memory_increase_in_MB'], '%.1f'), '', ''))
+        column_widths = [ max(len(row[i]) for row in [header] + rows) for i in range(len(header)) ]
+        def format_row(row):
+            return '  '.join([ row[0].ljust(column_widths[0]) ]
+                + [ value.rjust(width) for (value, width) in zip(row[1:], column_widths[1:]) ])
+        separator = '  '.join('-' * width for width in column_widths)
+        lines = [ format_row(header), separator ] + [ format_row(row) for row in rows[:-1] ] \
+            + [ separator, format_row(rows[-1]) ]
+        if total['peak_memory_in_MB'] is not None:
+            lines.append('peak memory: %.1f MB' % total['peak_memory_in_MB'])
+        return '\n'.join(lines)
@@ -0,0 +1,58 @@
+import numpy as np
+from scipy import sparse
+
+# --------------------------------------------------------------------------------------------------
+# A sparse (listings x products) matrix of the match values of the listings and products which matched,
+# with a parallel matrix of the codes of the match descriptions (see get_match_description_code).
+#
+# Both are CSR matrices with the same structure, so each stored entry of the value matrix
+# has its description code at the same position in the data of the description code matrix.
+# Within each listing's row, the entries are in order of product index.
+#
+# Note: A match value can be zero or negative, so the entries are always reduced over the stored entries
+#       (using the row pointers of the CSR matrix), rather than with the sparse matrix reductions
+#       which would treat the missing entries as zeros.
+#
+class MatchScoreMatrix(object):
+    def __init__(self, listing_indexes, product_indexes, match_values, match_desc_codes, shape):
+        listing_indexes = np.asarray(listing_indexes, dtype=np.int64)
+        product_indexes = np.asarray(product_indexes, dtype=np.int32)
+        sort_order = np.lexsort((product_indexes, listing_indexes))
+        listing_counts = np.bincount(listing_indexes, minlength=shape[0])
+        row_pointers = np.concatenate([[0], np.cumsum(listing_counts)])
+        product_indexes = product_indexes[sort_order]
+        self.match_values = sparse.csr_matrix(
+            (np.asarray(match_values, dtype=np.float64)[sort_order], product_indexes, row_pointers), shape=shape)
+        self.match_desc_codes = sparse.csr_matrix(
+            (np.asarray(match_desc_codes, dtype=np.int16)[sort_order], product_indexes, row_pointers), shape=shape)
+
+    @property
+    def entry_listing_indexes(self):
+        '''The listing index (i.e. row) of each stored entry'''
+        return np.repeat(np.arange(self.match_values.shape[0]), np.diff(self.match_values.indptr))
+
+    @property
+    def entry_product_indexes(self):
+        '''The product index (i.e. column) of each stored entry'''
+        return self.match_values.indices
+
+    def get_best_entries(self, is_allowed = None):
+        '''Returns the position of the highest valued entry of each listing, among the entries where is_allowed
+        is set (or all the entries if it is None). Listings without any allowed entries are left out.
+        If entries have the same value, the last of them (i.e. the one with the highest product index) is chosen.'''
+        entries = np.arange(self.match_values.nnz)
+        if is_allowed is not None:
+            entries = entries[is_allowed]
+        entry_listing_indexes = self.entry_listing_indexes[entries]
+        sort_order = np.lexsort((-entries, -self.match_values.data[entries], entry_listing_indexes))
+        sorted_listing_indexes = entry_listing_indexes[sort_order]
+        is_first_for_listing = np.ones(len(sort_order), dtype=bool)
+        is_first_for_listing[1:] = sorted_listing_indexes[1:] != sorted_listing_indexes[:-1]
+        return entries[sort_order[is_first_for_listing]]
+
+    def get_best_matches(self, is_allowed = None):
+        '''Returns the listing index, product index, match value and match description code
+        of the best entry of each listing (see get_best_entries), as parallel arrays in order of listing index'''
+        best_entries = self.get_best_entries(is_allowed)
+        return (self.entry_listing_indexes[best_entries], self.entry_product_indexes[best_entries],
+                self.match_values.data[best_entries], self.match_desc_codes.data[best_entries])
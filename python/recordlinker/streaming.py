@@ -0,0 +1,303 @@
+import cPickle
+import hashlib
+import json
+import mmap
+import os
+
+# --------------------------------------------------------------------------------------------------
+# Read a file of JSON records (one per line) in chunks of at most chunk_size lines.
+#
+# Each chunk is generated as a (line_offsets, line_lengths, columns) tuple, where line_offsets
+# and line_lengths give the byte offset and length (excluding the line ending) of each record's line.
+# This allows the raw JSON text of a record to be read again later (see JsonLinesMemoryMap)
+# without keeping all the parsed records in memory.
+#
+# The records are given as a dictionary of columns, mapping each field name to a list of the field's values
+# (with NaN where a record doesn't have the field). So each chunk can be passed directly to a DataFrame.
+#
+# If chunk_size is None, the whole file is read as a single chunk. Otherwise it must be a positive number.
+#
+# If a cache_dir is given, the parsed columns are also saved in a cache file in that folder,
+# and later calls read them from the cache file instead (see read_cached_json_line_blocks).
+#
+def read_json_line_chunks(file_path, chunk_size = None, cache_dir = None):
+    if chunk_size is not None and chunk_size < 1:
+        raise ValueError('The chunk size must be a positive number of lines, not %r' % chunk_size)
+    if cache_dir is None:
+        blocks = parse_json_line_blocks(file_path, chunk_size)
+    else:
+        blocks = read_cached_json_line_blocks(file_path, cache_dir)
+    return regroup_json_line_blocks(blocks, chunk_size)
+
+def parse_json_line_blocks(file_path, block_size = None):
+    with open(file_path, 'rb') as json_lines_file:
+        offset = 0
+        line_offsets = []
+        line_lengths = []
+        records = []
+        for line in json_lines_file:
+            line_offsets.append(offset)
+            line_lengths.append(len(line.rstrip('\r\n')))
+            records.append(json.loads(line))
+            offset += len(line)
+            if block_size and len(records) >= block_size:
+                yield line_offsets, line_lengths, convert_records_to_columns(records)
+                line_offsets = []
+                line_lengths = []
+                records = []
+        if len(records) > 0:
+            yield line_offsets, line_lengths, convert_records_to_columns(records)
+
+def convert_records_to_columns(records):
+    field_names = set(field_name for record in records for field_name in record)
+    nan = float('nan')
+    return dict((field_name, [record.get(field_name, nan) for record in records]) for field_name in field_names)
+
+def regroup_json_line_blocks(blocks, chunk_size = None):
+    '''Regroups the blocks of (line_offsets, line_lengths, columns) tuples into chunks of chunk_size lines'''
+    line_offsets = []
+    line_lengths = []
+    columns = {}
+    nan = float('nan')
+    for (block_line_offsets, block_line_lengths, block_columns) in blocks:
+        start = 0
+        while start < len(block_line_offsets):
+            stop = len(block_line_offsets)
+            if chunk_size:
+                stop = min(stop, start + chunk_size - len(line_offsets))
+            for field_name in set(columns) | set(block_columns):
+                column = columns.setdefault(field_name, [nan] * len(line_offsets))
+                column.extend(block_columns.get(field_name, [nan] * len(block_line_offsets))[start:stop])
+            line_offsets.extend(block_line_offsets[start:stop])
+            line_lengths.extend(block_line_lengths[start:stop])
+            start = stop
+            if chunk_size and len(line_offsets) >= chunk_size:
+                yield line_offsets, line_lengths, columns
+                line_offsets = []
+                line_lengths = []
+                columns = {}
+    if len(line_offsets) > 0:
+        yield line_offsets, line_lengths, columns
+
+# --------------------------------------------------------------------------------------------------
+# A cache of the parsed columns of a file of JSON lines.
+#
+# The cache file is a stream of pickled objects: a header with the fingerprint of the JSON lines file
+# (its size, modification time and the SHA-1 hash of its contents), followed by blocks of at most
+# CACHE_BLOCK_SIZE lines, in the same form as the chunks of read_json_line_chunks, and an end marker
+# with the total number of lines in the blocks.
+# The blocks are read one at a time, so that the whole file is not loaded into memory at once.
+#
+# The cache file is rebuilt whenever the fingerprint of the JSON lines file changes.
+# It is written with an AtomicFileWriter, so an interrupted run can't leave a partial cache.
+#
+# A cache file which is truncated or damaged anyway (i.e. which has no end marker, the wrong line count,
+# or can't be unpickled) is also rebuilt. Since its blocks are generated as they are read, the damage may
+# only be found after some of them have been generated. The rebuilt blocks then skip the lines already generated,
+# so that every line is generated exactly once.
+#
+CACHE_FORMAT_VERSION = 2
+CACHE_BLOCK_SIZE = 10000
+
+class DamagedCacheError(Exception):
+    pass
+
+def get_file_fingerprint(file_path):
+    file_stat = os.stat(file_path)
+    content_hash = hashlib.sha1()
+    with open(file_path, 'rb') as input_file:
+        for data in iter(lambda: input_file.read(1 << 20), ''):
+            content_hash.update(data)
+    return file_stat.st_size, file_stat.st_mtime, content_hash.hexdigest()
+
+def get_cache_file_path(file_path, cache_dir):
+    file_path_hash = hashlib.sha1(os.path.abspath(file_path)).hexdigest()[:12]
+    return os.path.join(cache_dir, '%s.%s.pickle' % (os.path.basename(file_path), file_path_hash))
+
+def read_cached_json_line_blocks(file_path, cache_dir):
+    cache_file_path = get_cache_file_path(file_path, cache_dir)
+    header = { 'version': CACHE_FORMAT_VERSION, 'fingerprint': get_file_fingerprint(file_path) }
+    generated_line_count = 0
+    if os.path.exists(cache_file_path):
+        try:
+            for block in load_cached_json_line_blocks(cache_file_path, header):
+                yield block
+                generated_line_count += len(block[0])
+            return
+        except DamagedCacheError:
+            pass
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    lines_to_skip = generated_line_count
+    with AtomicFileWriter(cache_file_path) as cache_file:
+        cPickle.dump(header, cache_file, cPickle.HIGHEST_PROTOCOL)
+        line_count = 0
+        for block in parse_json_line_blocks(file_path, CACHE_BLOCK_SIZE):
+            cPickle.dump(block, cache_file, cPickle.HIGHEST_PROTOCOL)
+            line_count += len(block[0])
+            if lines_to_skip >= len(block[0]):
+                lines_to_skip -= len(block[0])
+                continue
+            if lines_to_skip > 0:
+                block = skip_json_line_block_lines(block, lines_to_skip)
+                lines_to_skip = 0
+            yield block
+        cPickle.dump({ 'line_count': line_count }, cache_file, cPickle.HIGHEST_PROTOCOL)
+
+def load_cached_json_line_blocks(cache_file_path, header):
+    '''Generates the blocks of a cache file with the given header. Raises a DamagedCacheError 
+    if the header is different or the cache file is truncated or damaged (which may be after some blocks)'''
+    with open(cache_file_path, 'rb') as cache_file:
+        if load_cached_object(cache_file) != header:
+            raise DamagedCacheError('The cache file is for a different version of the file')
+        line_count = 0
+        while True:
+            cached_object = load_cached_object(cache_file)
+            if isinstance(cached_object, dict):
+                if cached_object.get('line_count') != line_count:
+                    raise DamagedCacheError('The cache file has the wrong number of lines')
+                return
+            line_count += len(cached_object[0])
+            yield cached_object
+
+def load_cached_object(cache_file):
+    try:
+        return cPickle.load(cache_file)
+    except Exception as error:  # A truncated or damaged pickle can raise almost any type of error
+        raise DamagedCacheError('The cache file could not be read: %s' % error)
+
+def skip_json_line_block_lines(block, line_count):
+    line_offsets, line_lengths, columns = block
+    return line_offsets[line_count:], line_lengths[line_count:], \
+        dict((field_name, values[line_count:]) for (field_name, values) in columns.iteritems())
+
+# --------------------------------------------------------------------------------------------------
+# A binary file which is written to a temporary file in the same folder, and only replaces the file
+# when it is committed. If it is discarded instead, the temporary file is removed,
+# so an interrupted run can't leave a partial file.
+#
+# When it is used in a with statement, it gives the temporary file, and is committed at the end of the block
+# (or discarded if an error occurs, including a generator being closed before it finishes writing).
+#
+class AtomicFileWriter(object):
+    def __init__(self, file_path, buffer_size = -1):
+        self.file_path = file_path
+        self.temp_file_path = file_path + '.%d.tmp' % os.getpid()
+        self.file = open(self.temp_file_path, 'wb', buffer_size)
+
+    def commit(self):
+        self.file.close()
+        try:
+            replace_file(self.temp_file_path, self.file_path)
+        except Exception:
+            self.discard()
+            raise
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.temp_file_path):
+            os.remove(self.temp_file_path)
+
+    def __enter__(self):
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+def replace_file(source_file_path, target_file_path):
+    if os.name == 'nt' and os.path.exists(target_file_path):
+        os.remove(target_file_path)  # os.rename can't replace a file on Windows
+    os.rename(source_file_path, target_file_path)
+
+# --------------------------------------------------------------------------------------------------
+# Load or save a single pickled object in a cache file, with a header describing what it depends on.
+# The cached object is only loaded if the header is unchanged, otherwise None is returned.
+#
+def load_pickled_cache(cache_file_path, header):
+    if not os.path.exists(cache_file_path):
+        return None
+    with open(cache_file_path, 'rb') as cache_file:
+        if cPickle.load(cache_file) != header:
+            return None
+        return cPickle.load(cache_file)
+
+def save_pickled_cache(cache_file_path, header, cached_object):
+    cache_dir = os.path.dirname(cache_file_path)
+    if cache_dir != '' and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    with AtomicFileWriter(cache_file_path) as cache_file:
+        cPickle.dump(header, cache_file, cPickle.HIGHEST_PROTOCOL)
+        cPickle.dump(cached_object, cache_file, cPickle.HIGHEST_PROTOCOL)
+
+# --------------------------------------------------------------------------------------------------
+# A read-only memory map of a file of JSON lines, giving the raw (utf-8 encoded) JSON text of a record
+# from the offset and length of its line. The text is not decoded, so it can be copied to an output file
+# without parsing and re-encoding it.
+#
+class JsonLinesMemoryMap(object):
+    def __init__(self, file_path):
+        self.file = open(file_path, 'rb')
+        if os.fstat(self.file.fileno()).st_size > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        else:
+            self.map = ''  # An empty file can't be memory-mapped
+
+    def get_raw_record(self, offset, length):
+        return self.map[offset:offset + length]
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# --------------------------------------------------------------------------------------------------
+# A writer of a file of JSON lines, which writes each line to a buffered binary file as soon as it is given,
+# so that the whole file is never held in memory. The lines are separated (rather than terminated) by line breaks.
+#
+# The lines are written with an AtomicFileWriter, so the file is only replaced when the writer is closed.
+# If an error occurs before then (see __exit__), the lines written so far are discarded instead.
+#
+# The number of lines and bytes written so far are kept in line_count and byte_count.
+#
+WRITE_BUFFER_SIZE = 1 << 16
+
+class JsonLinesWriter(object):
+    def __init__(self, file_path, buffer_size = WRITE_BUFFER_SIZE):
+        self.atomic_file = AtomicFileWriter(file_path, buffer_size)
+        self.file = self.atomic_file.file
+        self.line_count = 0
+        self.byte_count = 0
+
+    def write_line(self, line):
+        '''Writes a line of (utf-8 encoded) JSON, without its line ending'''
+        if self.line_count > 0:
+            self.file.write('\n')
+            self.byte_count += 1
+        self.file.write(line)
+        self.line_count += 1
+        self.byte_count += len(line)
+
+    def close(self):
+        self.atomic_file.commit()
+
+    def discard(self):
+        self.atomic_file.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,110 @@
+import unittest
+import re
+from recordlinker.candidates import *
+
+class AhoCorasickAutomatonTestCase(unittest.TestCase):
+    def testAllOccurrencesAreFoundIncludingOverlappingOnes(self):
+        automaton = AhoCorasickAutomaton(['he', 'she', 'his', 'hers', ''])
+        occurrences = sorted(automaton.find_all('ushers'))
+        self.assertEqual(occurrences, [(0, 4), (1, 4), (3, 6)])
+    
+    def testNoOccurrencesAreFoundInAnEmptyText(self):
+        automaton = AhoCorasickAutomaton(['a'])
+        self.assertEqual(list(automaton.find_all('')), [])
+
+class ProductCodeIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = ProductCodeIndex([
+            (0, [['cybershotdscw310'], ['dscw310']]),
+            (1, [['cybershotdscw330'], ['dscw330']]),
+            (2, [['cybershot', 'dsct99']]),
+            (3, [['cybershotdschx100v'], []])
+        ])
+    
+    def testCandidatesAreFoundIgnoringCaseWhitespaceAndDashes(self):
+        self.assertEqual(self.index.find_candidates(u'Sony DSC W 3-10 Digital Camera'), [0, 3])
+    
+    def testAllLiteralsInAGroupMustBeFound(self):
+        self.assertEqual(self.index.find_candidates(u'Sony DSC-T99'), [3])
+        self.assertEqual(self.index.find_candidates(u'Sony Cyber-shot DSC-T99'), [2, 3])
+    
+    def testAProductWithAnEmptyGroupIsAlwaysACandidate(self):
+        self.assertEqual(self.index.find_candidates(u''), [3])
+        self.assertEqual(self.index.find_candidates(None), [3])
+    
+    def testCandidatesAreFoundWhenAProductCodeIsEmbeddedInOtherText(self):
+        'The index is a pre-filter, so it should not reject matches which the regexes might find'
+        self.assertEqual(self.index.find_candidates(u'SonyDSCW330'), [1, 3])
+    
+    def testAProductWithNoLiteralGroupsIsNeverACandidate(self):
+        index = ProductCodeIndex([(0, [])])
+        self.assertEqual(index.find_candidates(u'Anything at all'), [])
+
+class ProductCodeScannerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scanner = ProductCodeScanner([
+            (0, u'Cyber-shotDSC-W310'),
+            (1, u'ExilimEX-Z3'),
+            (2, u'ExilimEX-Z33'),
+            (3, u'Coolpix S6100')
+        ])
+    
+    def testCodeIsFoundWithOptionalWhitespaceAndDashes(self):
+        self.assertEqual(self.scanner.find_products(u'Sony CYBERSHOT dsc w 3-10 Camera'), [0])
+    
+    def testCodeIsNotFoundWithMultipleDashesBetweenCharacters(self):
+        self.assertEqual(self.scanner.find_products(u'Sony Cybershot DSC--W310'), [])
+    
+    def testCodeIsNotFoundInTheMiddleOfAWord(self):
+        self.assertEqual(self.scanner.find_products(u'Nikon XCoolpix S6100'), [])
+        self.assertEqual(self.scanner.find_products(u'Nikon Coolpix S61000'), [])
+        self.assertEqual(self.scanner.find_products(u'Nikon Coolpix S6100-B'), [])
+    
+    def testNumericCodeIsNotFoundWhenFollowedByADecimalNumber(self):
+        self.assertEqual(self.scanner.find_products(u'Casio Exilim EX-Z3 3.2MP'), [1])
+        self.assertEqual(self.scanner.find_products(u'Casio Exilim EX-Z33.2MP'), [])
+    
+    def testCodeIsFoundLaterInTheTextWhenTheFirstOccurrenceIsInvalid(self):
+        self.assertEqual(self.scanner.find_products(u'Nikon Coolpix S6100X, Coolpix S6100'), [3])
+    
+    def testNothingIsFoundInAMissingText(self):
+        self.assertEqual(self.scanner.find_products(None), [])
+    
+    def testAlreadyNormalizedTextGivesTheSameProducts(self):
+        text = u'Nikon Coolpix S6100X, Coolpix S 61-00'
+        normalized_text, positions = normalize_match_text_with_positions(text)
+        self.assertEqual(self.scanner.find_products(text, normalized_text, positions), self.scanner.find_products(text))
+        self.assertEqual(self.scanner.find_products(text, normalized_text, positions), [3])
+
+class ExactMatchRegexOracleTestCase(unittest.TestCase):
+    '''The scanner should find the same products as searching with each product's exact match regex'''
+    def get_exact_match_pattern(self, code):
+        # Remove all white-space and dashes:
+        escaped_text = re.sub(r'(\s|\-)+', '', code)
+        is_last_char_numeric = len(escaped_text) > 0 and escaped_text[-1].isdigit()
+        # Insert a dash after every character as a place-holder, then replace it with
+        # a regex sequence matching whitespace characters and/or a single dash:
+        escaped_text = re.escape('-'.join(escaped_text))
+        escaped_text = re.sub(r'\\\-', r'\s*(?:\-\s*)?', escaped_text)
+        # Do negative lookbehind and lookahead to ensure this is not in the middle of a word:
+        escaped_text = r'(?<!\w)' + escaped_text
+        if is_last_char_numeric:
+            return escaped_text + r'(?!\w|\-|\.\d|\,\d)'
+        return escaped_text + r'(?!\w|\-)'
+    
+    def testScannerFindsTheSameProductsAsTheExactMatchRegexes(self):
+        codes = [u'Cyber-shotDSC-W310', u'ExilimEX-Z3', u'ExilimEX-Z33', u'Coolpix S6100', u'EOS 7D', u'D90', u'T99']
+        texts = [u'Sony CYBERSHOT dsc w 3-10 Camera', u'Sony Cybershot DSC--W310', u'Nikon XCoolpix S6100',
+                 u'Nikon Coolpix S61000', u'Nikon Coolpix S6100-B', u'Casio Exilim EX-Z3 3.2MP', 
+                 u'Casio Exilim EX-Z33.2MP', u'Casio Exilim EX - Z33,5', u'Nikon Coolpix S6100X, Coolpix S6100', 
+                 u'Canon EOS-7D / Nikon D90 kit', u'Nikon D 9 0', u'Sony DSC-T99_B', u'Sony T99\xe9', u'']
+        scanner = ProductCodeScanner(enumerate(codes))
+        regexes = [re.compile(self.get_exact_match_pattern(code), re.IGNORECASE) for code in codes]
+        for text in texts:
+            expected_products = [product_key for (product_key, regex) in enumerate(regexes) if regex.search(text)]
+            self.assertEqual(scanner.find_products(text), expected_products)
+
+
+# Run unit tests from the command line:        
+if __name__ == '__main__':
+    unittest.main()
@@ -37,6 +37,19 @@ class MatchValueFunctionTestCase(unittest.TestCase):
         expected_val = self.fixed_val + self.per_char_val * matched_char_count - self.family_and_model_len
         self.assertEqual(val, expected_val)
     
+    def testMaxValueIsTheValueOfMatchingAllTheCharsBeforeASeparator(self):
+        val = self.match_valueFunc.get_max_value(20, self.family_and_model_len)
+        self.assertEqual(val, self.match_valueFunc.evaluate(20, self.family_and_model_len, is_after_sep = False))
+        self.assertEqual(self.match_valueFunc.get_max_value(0, self.family_and_model_len), 0)
+    
+    def testMaxValueIsAnUpperBoundOnTheValue(self):
+        value_funcs = [ self.match_valueFunc, MatchValueFunction(0, 0), MatchValueFunction(-5, 1) ]
+        for value_func in value_funcs:
+            max_val = value_func.get_max_value(8, self.family_and_model_len)
+            for matched_char_count in range(9):
+                for is_after_sep in [False, True]:
+                    self.assert_(value_func.evaluate(matched_char_count, self.family_and_model_len, is_after_sep) <= max_val)
+    
 
 class MatchingRuleStub(MatchingRule):
     def __init__(self, text_to_find, desc_value, details_value):
@@ -44,7 +57,7 @@ class MatchingRuleStub(MatchingRule):
         self.product_desc_value = desc_value
         self.product_details_value = details_value
     
-    def try_match(self, product_desc, extra_prod_details = None):
+    def try_match(self, product_desc, extra_prod_details = None, listing_context = None):
         if product_desc.find(self.to_find) != -1:
             return MatchResult(True, self.product_desc_value)
         if extra_prod_details.find(self.to_find) != -1:
@@ -264,6 +277,188 @@ class MasterTemplateTestCase(unittest.TestCase):
         engine = master.generate(self.blocks, self.family_and_model_len)
         self.assert_(isinstance(engine.listing_matchers, list) and len(engine.listing_matchers) > 0, "expected non-empty list of listing matchers")
         self.assert_(len(engine.listing_matchers[0].optional_matching_rules) == 2, "expected 2 optional matching rules in first listing matcher")
+    
+    def testRequiredLiteralGroups(self):
+        'Only mandatory rules which must match on the product description should contribute literals'
+        optional_on_details_tpl = RegexRuleTemplate(self.slices_optional[1:2], 
+            self.optional_value_func_on_desc, self.optional_value_func_on_details, must_match_on_desc = False)
+        lm_tpl_1 = ListingMatcherTemplate('prod_code', [self.prod_code_mandatory_tpl], [self.optional_tpl_1])
+        lm_tpl_2 = ListingMatcherTemplate('shot_on_details', [optional_on_details_tpl], [])
+        master = MasterTemplate("a-a+a-an", [lm_tpl_1, lm_tpl_2])
+        engine = master.generate(self.blocks, self.family_and_model_len)
+        self.assertEqual(engine.get_required_literal_groups(), [['dscw310'], []])
+
+
+class NormalizeMatchTextTestCase(unittest.TestCase):
+    def testWhitespaceAndDashesAreRemovedAndTextIsLowerCased(self):
+        self.assertEqual(normalize_match_text(u'Cyber-shot DSC - W310 (4.3)'), u'cybershotdscw310(4.3)')
+    
+    def testNoneIsNormalizedToAnEmptyString(self):
+        self.assertEqual(normalize_match_text(None), '')
+
+class CompiledRegexCacheTestCase(unittest.TestCase):
+    def testSamePatternAndFlagsGiveTheSameRegex(self):
+        regex = get_compiled_regex(u'cyber\\-?shot', re.IGNORECASE)
+        self.assertIs(get_compiled_regex(u'cyber\\-?shot', re.IGNORECASE), regex)
+        self.assertIsNot(get_compiled_regex(u'cyber\\-?shot'), regex)
+    
+    def testRulesGeneratedForTheSameTextShareTheirRegex(self):
+        template = RegexRuleTemplate([slice(0, 1)], MatchValueFunction(1000, 10), MatchValueFunction(0, 0))
+        rule_1 = template.generate([u'Cyber-shot', u'W310'], 14)
+        rule_2 = template.generate([u'Cyber-shot', u'T99'], 13)
+        self.assertIs(rule_1.match_regex, rule_2.match_regex)
+
+class CompactObjectsTestCase(unittest.TestCase):
+    def setUp(self):
+        value_func = MatchValueFunction(1000, 10)
+        self.rule = RegexMatchingRule(re.compile('W310', re.IGNORECASE), 4, value_func, MatchValueFunction(0, 0))
+        self.engine = MatchingEngine([ ListingMatcher('Model', [ self.rule ], []) ])
+    
+    def testFailedMatchesShareASingleResult(self):
+        self.assert_(self.rule.try_match(u'Sony DSC-T99') is no_match_result)
+        self.assert_(self.engine.try_match_listing(u'Sony DSC-T99', u'case') is no_match_result)
+        self.assert_(not no_match_result.is_match)
+    
+    def testSuccessfulMatchesDontChangeTheSharedResult(self):
+        self.assert_(self.engine.try_match_listing(u'Sony DSC-W310', None).is_match)
+        self.assertEqual(no_match_result.match_value, 0)
+        self.assertEqual(no_match_result.description, "")
+    
+    def testObjectsHaveNoInstanceDictionary(self):
+        for obj in [self.rule, self.rule.value_func_on_product_desc, self.engine, self.engine.listing_matchers[0],
+                    no_match_result]:
+            self.assert_(not hasattr(obj, '__dict__'), type(obj).__name__)
+
+class MaxMatchValueTestCase(unittest.TestCase):
+    def setUp(self):
+        value_func = MatchValueFunction(1000, 10)
+        details_value_func = MatchValueFunction(10, 1)
+        no_value_func = MatchValueFunction(0, 0)
+        family_and_model_len = len('Cyber-shotW310')
+        model_rule = RegexMatchingRule(re.compile('W\\-?310', re.IGNORECASE), family_and_model_len, 
+            value_func, details_value_func, must_match_on_desc = True)
+        family_rule = RegexMatchingRule(re.compile('Cyber\\-?shot', re.IGNORECASE), family_and_model_len, 
+            value_func, details_value_func)
+        self.engine = MatchingEngine([
+            ListingMatcher('FamilyAndModel', [ model_rule, family_rule ], []),
+            ListingMatcher('Model', [ model_rule ], [ family_rule ]),
+            ListingMatcher('Family', [ RegexMatchingRule(re.compile('Cyber\\-?shot', re.IGNORECASE), 
+                family_and_model_len, value_func, no_value_func) ], [])
+        ])
+    
+    def testMaxMatchValueIsAnUpperBound(self):
+        listings = [
+            (u'Sony Cyber-shot DSC-W310', None),
+            (u'Sony DSC-W310 (Cyber-shot)', u'Cyber-shot case'),
+            (u'Sony DSC-W310', u'with Cyber-shot case'),
+            (u'Sony Cyber-shot', None),
+            (u'W310', None)
+        ]
+        for (product_desc, extra_prod_details) in listings:
+            listing_context = ListingContext(product_desc, extra_prod_details)
+            match_result = self.engine.try_match_listing(product_desc, extra_prod_details)
+            self.assert_(match_result.is_match)
+            self.assert_(match_result.match_value <= self.engine.get_max_match_value(listing_context))
+    
+    def testEngineWithoutMatchersCannotMatch(self):
+        listing_context = ListingContext(u'Sony Cyber-shot DSC-W310')
+        self.assertEqual(MatchingEngine([]).get_max_match_value(listing_context), float('-inf'))
+        self.assertEqual(ListingMatcher('None', [], []).get_max_match_value(listing_context), float('-inf'))
+
+class ListingContextTestCase(unittest.TestCase):
+    def testListingTextIsDerivedOnce(self):
+        listing_text = ListingText(u'Cyber-shot DSC - W310 (4.3)')
+        self.assertEqual(listing_text.separator_position, 22)
+        self.assertEqual(listing_text.normalized_text, u'cybershotdscw310(4.3)')
+        self.assertEqual(listing_text.normalized_text, normalize_match_text(listing_text.text))
+        self.assertEqual(listing_text.normalized_positions[:7], [0, 1, 2, 3, 4, 6, 7])
+    
+    def testOnlyAsciiIsNormalizedAsForTheRuleRegexes(self):
+        'The rule regexes ignore case without the re.UNICODE flag, so only ASCII letters and white-space are normalized'
+        listing_text = ListingText(u'\xc9OS\xa07D')
+        self.assertEqual(listing_text.normalized_text, u'\xc9os\xa07d')
+        self.assertEqual(listing_text.normalized_positions, [0, 1, 2, 3, 4, 5])
+    
+    def testListingTextWithoutASeparator(self):
+        self.assertEqual(ListingText(u'Canon EOS 7D').separator_position, None)
+    
+    def testMissingExtraProductDetails(self):
+        listing_context = ListingContext(u'Canon EOS 7D')
+        self.assertEqual(listing_context.product_desc.text, u'Canon EOS 7D')
+        self.assertEqual(listing_context.extra_prod_details, None)
+    
+    def testRegexRuleGivesTheSameResultWithASharedContext(self):
+        rule = RegexMatchingRule(re.compile('W310', re.IGNORECASE), 10, MatchValueFunction(1000, 10), MatchValueFunction(0, 0))
+        for listing in [ (u'Sony DSC-W310', None), (u'Sony DSC (W310)', None), (u'Sony DSC/W310', u'W310 case') ]:
+            match_result = rule.try_match(* listing)
+            shared_match_result = rule.try_match(* listing, listing_context = ListingContext(* listing))
+            self.assertEqual(shared_match_result.is_match, match_result.is_match)
+            self.assertEqual(shared_match_result.match_value, match_result.match_value)
+
+class CountingRegex(object):
+    def __init__(self, pattern):
+        self.regex = re.compile(pattern, re.IGNORECASE)
+        self.search_count = 0
+    
+    def search(self, text):
+        self.search_count = self.search_count + 1
+        return self.regex.search(text)
+
+class MemoizedRuleResultsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.family_regex = CountingRegex('cyber\\-?shot')
+        value_func = MatchValueFunction(1000, 10)
+        no_value_func = MatchValueFunction(0, 0)
+        self.engines = [
+            MatchingEngine([ ListingMatcher('FamilyAndModel', 
+                [ RegexMatchingRule(re.compile(model, re.IGNORECASE), 10, value_func, no_value_func) ], 
+                [ RegexMatchingRule(self.family_regex, 10, value_func, no_value_func) ]) ])
+            for model in ['W310', 'T99', 'W30']
+        ]
+        self.listing = (u'Sony Cyber-shot DSC-W310 / T99', u'Cyber-shot case')
+    
+    def get_match_values(self, memoize_rule_results):
+        listing_context = ListingContext(* self.listing, memoize_rule_results = memoize_rule_results)
+        return [ engine.try_match_listing(* self.listing, listing_context = listing_context).match_value 
+                 for engine in self.engines ]
+    
+    def testMemoizedResultsAreTheSame(self):
+        self.assertEqual(self.get_match_values(True), self.get_match_values(False))
+        for engine in self.engines:
+            self.assertEqual(engine.try_match_listing(* self.listing, memoize_rule_results = True).match_value,
+                engine.try_match_listing(* self.listing).match_value)
+    
+    def testEachRegexIsOnlySearchedOncePerListing(self):
+        self.get_match_values(True)
+        self.assertEqual(self.family_regex.search_count, 1)
+    
+    def testEachRegexIsSearchedPerRuleWithoutMemoization(self):
+        self.get_match_values(False)
+        self.assertEqual(self.family_regex.search_count, 2)
+
+class MatchDescriptionCodeTestCase(unittest.TestCase):
+    def setUp(self):
+        value_func = MatchValueFunction(1000, 10)
+        no_value_func = MatchValueFunction(0, 0)
+        self.engine = MatchingEngine([
+            ListingMatcher('ModelAndFamily', 
+                [ RegexMatchingRule(re.compile('W310', re.IGNORECASE), 10, value_func, no_value_func),
+                  RegexMatchingRule(re.compile('Cyber\\-?shot', re.IGNORECASE), 10, value_func, no_value_func) ], []),
+            ListingMatcher('Model', 
+                [ RegexMatchingRule(re.compile('W310', re.IGNORECASE), 10, value_func, no_value_func) ], [])
+        ])
+    
+    def testDescriptionCodesAreRegisteredWhenMatchersAreCreated(self):
+        code = get_match_description_code('Model')
+        self.assertEqual(self.engine.listing_matchers[1].match_desc_code, code)
+        self.assertEqual(match_descriptions[code], 'Model')
+        self.assertEqual(get_match_description_code(''), 0)
+    
+    def testMatchResultsCarryTheCodeOfTheMatchersDescription(self):
+        match_result = self.engine.try_match_listing(u'Sony DSC-W310', None)
+        self.assertEqual(match_result.description, 'Model')
+        self.assertEqual(match_result.description_code, get_match_description_code('Model'))
+        self.assertEqual(self.engine.try_match_listing(u'Sony DSC-W330', None).description_code, 0)
 
 
 # Run unit tests from the command line:        
@@ -0,0 +1,65 @@
+import unittest
+import numpy as np
+from recordlinker.features import *
+
+class ExtractListingFeaturesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.features = extract_listing_features([
+            u'Nikon Coolpix L120 Digital Camera - Red (14.1MP, 21x Optical Zoom) 3-inch LCD',
+            u'GE - J1050 - Appareil photo compact num\xe9rique - 10,1 Mpix - Zoom optique 5 X - Ecran LCD 2,7"',
+            u'Nikon D40X Digital SLR Camera',
+            u'Canon PowerShot SD1300IS 12 Megapixel 4 x zoom 2.7 inches (Blue) / 16 MP',
+            u''])
+
+    def testFeaturesAreFloat32Arrays(self):
+        for feature in [self.features.megapixels, self.features.rounded_megapixels,
+                        self.features.optical_zoom, self.features.screen_size]:
+            self.assertEqual(feature.dtype, np.float32)
+            self.assertEqual(len(feature), 5)
+
+    def testFirstOccurrenceOfEachFeature(self):
+        np.testing.assert_array_equal(self.features.megapixels, np.float32([14.1, 10.1, np.nan, 12.0, np.nan]))
+        np.testing.assert_array_equal(self.features.optical_zoom, np.float32([21.0, 5.0, np.nan, 4.0, np.nan]))
+        np.testing.assert_array_equal(self.features.screen_size, np.float32([3.0, 2.7, np.nan, 2.7, np.nan]))
+
+    def testRoundedMegapixels(self):
+        np.testing.assert_array_equal(self.features.rounded_megapixels, np.float32([14, 10, np.nan, 12, np.nan]))
+
+    def testRoundingIsNotAffectedByFloat32Precision(self):
+        features = extract_listing_features([u'9.99999999 MP'])
+        self.assertEqual(features.megapixels[0], np.float32(10.0))
+        self.assertEqual(features.rounded_megapixels[0], 9.0)
+
+    def testMegapixelsAreTheFirstMatchOfTheMegapixelPattern(self):
+        product_descs = [u'Canon 12.1 mega pixels', u'Sony 8-MP 3x', u'Sony 12MPixels', u'1212MP', u'Leica 5 Mio. Pixel',
+                         u'Nikon 12 MPG', u'Nikon 12.1MP/14MP']
+        megapixels_regex = re.compile(megapixels_pattern, re.IGNORECASE | re.VERBOSE)
+        features = extract_listing_features(product_descs)
+        for (product_desc, megapixels) in zip(product_descs, features.megapixels):
+            match_obj = megapixels_regex.search(product_desc)
+            if match_obj is None:
+                self.assertTrue(np.isnan(megapixels))
+            else:
+                self.assertEqual(megapixels, np.float32(match_obj.group('megapixels').replace(',', '.')))
+
+    def testZoomAndScreenSizeAreTheFirstMatchesOfTheirPatterns(self):
+        product_descs = [u'Sony 5X zoom 3.0-INCH LCD', u'Nikon D40X 10x', u'Canon 1.5x2,7" 4 x', u'Sony 3 In. 12 x/2.5 inches',
+                         u'Nikon 3.5 Inch 4.3x', u'Canon 12.5x3 inch', u'Olympus 3inchscreen', u'Leica 3\'\' 7xz']
+        features = extract_listing_features(product_descs)
+        for (pattern, values) in [(optical_zoom_pattern, features.optical_zoom), (screen_size_pattern, features.screen_size)]:
+            feature_regex = re.compile(pattern, re.IGNORECASE | re.VERBOSE)
+            for (product_desc, value) in zip(product_descs, values):
+                match_obj = feature_regex.search(product_desc)
+                if match_obj is None:
+                    self.assertTrue(np.isnan(value))
+                else:
+                    self.assertEqual(value, np.float32(match_obj.group(match_obj.lastgroup).replace(',', '.')))
+
+class IgnoreAsciiCaseTestCase(unittest.TestCase):
+    def testLettersAreReplacedButNotEscapeSequences(self):
+        self.assertEqual(ignore_ascii_case(r'\s*in\.|"'), r'\s*[iI][nN]\.|"')
+
+
+# Run unit tests from the command line:
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+from recordlinker.fuzzy import *
+
+class LevenshteinDistanceTestCase(unittest.TestCase):
+    def testDistances(self):
+        self.assertEqual(levenshtein_distance('kitten', 'sitting'), 3)
+        self.assertEqual(levenshtein_distance('sitting', 'kitten'), 3)
+        self.assertEqual(levenshtein_distance('olympus', 'olympus'), 0)
+        self.assertEqual(levenshtein_distance('', 'sony'), 4)
+        self.assertEqual(levenshtein_distance(u'panasonic', u'panasonik'), 1)
+
+    def testCalculationStopsEarlyAtTheMaximumDistance(self):
+        self.assertEqual(levenshtein_distance('kitten', 'sitting', max_distance = 1), 2)
+        self.assertEqual(levenshtein_distance('canon', 'fujifilm', max_distance = 2), 3)
+        self.assertEqual(levenshtein_distance('kitten', 'sitting', max_distance = 3), 3)
+
+class BKTreeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.words = ['canon', 'nikon', 'sony', 'samsung', 'fuji', 'kodak', 'olympus', 'pentax', 'canon']
+        self.tree = BKTree(self.words)
+
+    def testWordsWithinTheDistanceAreFound(self):
+        self.assertEqual(self.tree.find_within('cannon', 2), [0, 8])
+        self.assertEqual(self.tree.find_within('nikkon', 1), [1])
+        self.assertEqual(self.tree.find_within('xyzzyx', 2), [])
+
+    def testResultsAreTheSameAsComparingEveryWord(self):
+        for query in ['canon', 'samsumg', 'olimpus', 'pentaks', 'kodac', 'sonny', 'fujii']:
+            for max_distance in range(4):
+                expected_ids = [word_id for (word_id, word) in enumerate(self.words)
+                                if levenshtein_distance(query, word) <= max_distance]
+                self.assertEqual(self.tree.find_within(query, max_distance), expected_ids)
+
+    def testEmptyTreeFindsNothing(self):
+        self.assertEqual(BKTree([]).find_within('canon', 2), [])
+
+
+# Run unit tests from the command line:
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from recordlinker.parallel import *
+
+class RowPartitionsTestCase(unittest.TestCase):
+    def testNewPartitionIsStartedWhenTheKeyChanges(self):
+        partitions = get_row_partitions(['Canon', 'Canon', 'Sony', 'Nikon', 'Nikon'], max_chunk_size = 10)
+        self.assertEqual(partitions, [(0, 2), (2, 3), (3, 5)])
+    
+    def testLargePartitionsAreSplitIntoChunks(self):
+        partitions = get_row_partitions(['Canon'] * 5 + ['Sony'], max_chunk_size = 2)
+        self.assertEqual(partitions, [(0, 2), (2, 4), (4, 5), (5, 6)])
+    
+    def testNoRowsGiveNoPartitions(self):
+        self.assertEqual(get_row_partitions([], max_chunk_size = 2), [])
+
+class ForkedWorkerPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.shared_args = range(100)
+        self.tasks = [(0, 10), (10, 50), (50, 51), (51, 100)]
+        self.expected_results = [sum(range(start, stop)) for (start, stop) in self.tasks]
+    
+    def sum_rows(self, shared_args, task):
+        start, stop = task
+        return sum(shared_args[start:stop])
+    
+    def testSerialResultsAreInTaskOrder(self):
+        with ForkedWorkerPool(self.sum_rows, self.shared_args, jobs = 1) as worker_pool:
+            results = worker_pool.map(self.tasks)
+        self.assertEqual(results, self.expected_results)
+    
+    def testParallelResultsAreTheSameAsSerialResults(self):
+        with ForkedWorkerPool(self.sum_rows, self.shared_args, jobs = 3) as worker_pool:
+            results = worker_pool.map(self.tasks)
+        self.assertEqual(results, self.expected_results)
+    
+    def sum_rows_with_offset(self, offset, task):
+        return offset + sum(task)
+    
+    def testPoolIsReusedForEachListOfTasks(self):
+        with ForkedWorkerPool(self.sum_rows_with_offset, 1000, jobs = 2) as worker_pool:
+            self.assertEqual(worker_pool.map([[1, 2], [3], [4, 5, 6]]), [1003, 1003, 1015])
+            self.assertEqual(worker_pool.map([[7], [8, 9]]), [1007, 1017])
+        self.assertIsNone(worker_pool.pool)
+    
+    def testAtLeastOneJobIsRequired(self):
+        self.assertRaises(ValueError, ForkedWorkerPool, self.sum_rows_with_offset, 0, jobs = 0)
+
+
+# Run unit tests from the command line:        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import json
+import os
+import tempfile
+import recordlinker.profiling
+from recordlinker.profiling import *
+
+class StageProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.profiler = StageProfiler()
+
+    def get_stage(self, name):
+        return [ stage for stage in self.profiler.get_report()['stages'] if stage['name'] == name ][0]
+
+    def testStageFiguresAreMeasured(self):
+        self.profiler.start_stage('title splitting', rows_in = 10)
+        sum(xrange(100000))
+        self.profiler.end_stage(rows_out = 8)
+        stage = self.get_stage('title splitting')
+        self.assertEqual(stage['run_count'], 1)
+        self.assertTrue(stage['wall_time'] > 0.0)
+        self.assertTrue(stage['cpu_time'] >= 0.0)
+        self.assertTrue(stage['peak_memory_increase_in_MB'] >= 0.0)
+        self.assertEqual((stage['rows_in'], stage['rows_out']), (10, 8))
+
+    def testRepeatedStagesAreAddedTogetherInTheOrderTheyWereFirstStarted(self):
+        for chunk_size in [5, 3]:
+            self.profiler.start_stage('manufacturer mapping', rows_in = chunk_size)
+            self.profiler.end_stage(rows_out = chunk_size - 1)
+            self.profiler.start_stage('engine execution')
+            self.profiler.end_stage()
+        report = self.profiler.get_report()
+        self.assertEqual([ stage['name'] for stage in report['stages'] ], ['manufacturer mapping', 'engine execution'])
+        stage = self.get_stage('manufacturer mapping')
+        self.assertEqual((stage['run_count'], stage['rows_in'], stage['rows_out']), (2, 8, 6))
+        self.assertEqual((self.get_stage('engine execution')['rows_in']), None)
+
+    def testStartingAStageEndsTheCurrentStage(self):
+        self.profiler.start_stage('unique listings')
+        self.profiler.start_stage('feature extraction')
+        self.profiler.end_stage()
+        self.assertEqual(self.get_stage('unique listings')['run_count'], 1)
+        self.assertEqual(self.get_stage('feature extraction')['run_count'], 1)
+
+    def testIteratedItemsAreCountedAsRowsOut(self):
+        chunks = [ [1, 2, 3], [4, 5] ]
+        items = list(self.profiler.iterate_stage('listing input', chunks, count_rows = len))
+        self.assertEqual(items, chunks)
+        stage = self.get_stage('listing input')
+        self.assertEqual((stage['run_count'], stage['rows_out']), (3, 5))
+
+    def testMemoryIsNotMeasuredWithoutTheResourceModule(self):
+        saved_resource = recordlinker.profiling.resource
+        recordlinker.profiling.resource = None
+        try:
+            profiler = StageProfiler()
+            profiler.start_stage('output')
+            profiler.end_stage()
+            report = profiler.get_report()
+        finally:
+            recordlinker.profiling.resource = saved_resource
+        self.assertEqual(report['stages'][0]['peak_memory_increase_in_MB'], None)
+        self.assertEqual(report['total']['peak_memory_in_MB'], None)
+
+class StageReportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.profiler = StageProfiler()
+        self.profiler.start_stage('load products')
+        self.profiler.end_stage(rows_out = 743)
+        self.profiler.start_stage('engine execution', rows_in = 7614)
+        self.profiler.end_stage(rows_out = 6259)
+
+    def testJsonReportIsWritten(self):
+        file_handle, file_path = tempfile.mkstemp(suffix = '.json')
+        os.close(file_handle)
+        try:
+            self.profiler.write_json_report(file_path)
+            with open(file_path, 'rb') as report_file:
+                report = json.load(report_file)
+        finally:
+            os.remove(file_path)
+        self.assertEqual([ stage['name'] for stage in report['stages'] ], ['load products', 'engine execution'])
+        self.assertEqual(report['stages'][1]['rows_out'], 6259)
+        self.assertTrue(report['total']['wall_time'] >= report['stages'][1]['wall_time'])
+
+    def testTableHasARowPerStageAndATotalRow(self):
+        lines = self.profiler.format_report_table().split('\n')
+        self.assertTrue(lines[0].startswith('stage'))
+        self.assertTrue(lines[2].startswith('load products'))
+        self.assertTrue(lines[2].endswith('743'))
+        self.assertTrue(lines[3].startswith('engine execution'))
+        self.assertTrue(lines[5].startswith('total'))
+        self.assertEqual(len(set(len(line) for line in lines[:6])), 1)
+
+
+# Run unit tests from the command line:
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+from recordlinker.scores import *
+
+class MatchScoreMatrixTestCase(unittest.TestCase):
+    def setUp(self):
+        # Listing 1 has no matches, and the matches are not in order of listing and product:
+        self.match_scores = MatchScoreMatrix(
+            listing_indexes = [2, 0, 2, 0, 3, 2],
+            product_indexes = [4, 1, 0, 3, 2, 3],
+            match_values = [500.0, 10.0, 700.0, 30.0, -5.0, 700.0],
+            match_desc_codes = [1, 2, 3, 1, 2, 2],
+            shape = (4, 5))
+
+    def testEntriesAreInOrderOfListingThenProduct(self):
+        self.assertEqual(list(self.match_scores.entry_listing_indexes), [0, 0, 2, 2, 2, 3])
+        self.assertEqual(list(self.match_scores.entry_product_indexes), [1, 3, 0, 3, 4, 2])
+        self.assertEqual(list(self.match_scores.match_desc_codes.data), [2, 1, 3, 2, 1, 2])
+
+    def testBestMatchOfEachListing(self):
+        listing_indexes, product_indexes, match_values, match_desc_codes = self.match_scores.get_best_matches()
+        self.assertEqual(list(listing_indexes), [0, 2, 3])
+        self.assertEqual(list(match_values), [30.0, 700.0, -5.0])
+        self.assertEqual(list(match_desc_codes), [1, 2, 2])
+
+    def testTiesAreWonByTheHighestProductIndex(self):
+        listing_indexes, product_indexes, match_values, match_desc_codes = self.match_scores.get_best_matches()
+        self.assertEqual(list(product_indexes), [3, 3, 2])
+
+    def testOnlyAllowedEntriesAreConsidered(self):
+        is_allowed = np.array([True, False, True, False, True, False])
+        listing_indexes, product_indexes, match_values, match_desc_codes \
+            = self.match_scores.get_best_matches(is_allowed)
+        self.assertEqual(list(listing_indexes), [0, 2])
+        self.assertEqual(list(product_indexes), [1, 0])
+
+    def testEmptyMatrix(self):
+        match_scores = MatchScoreMatrix([], [], [], [], shape = (3, 2))
+        self.assertEqual(len(match_scores.get_best_entries()), 0)
+
+
+# Run unit tests from the command line:
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+import unittest
+import math
+import os
+import shutil
+import tempfile
+import recordlinker.streaming
+from recordlinker.streaming import *
+
+class JsonLineChunksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            '{"title": "Canon PowerShot SD980 IS", "manufacturer": "Canon"}\n',
+            '{"title": "Sony T Series DSC-T99", "manufacturer": "Sony"}\r\n',
+            '{"title": "Nikon D300S \\u00e9dition", "manufacturer": "Nikon"}'
+        ]
+        file_handle, self.file_path = tempfile.mkstemp(suffix = '.txt')
+        with os.fdopen(file_handle, 'wb') as json_lines_file:
+            json_lines_file.write(''.join(self.lines))
+        self.expected_offsets = [0, len(self.lines[0]), len(self.lines[0]) + len(self.lines[1])]
+        self.expected_lengths = [len(line.rstrip('\r\n')) for line in self.lines]
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def testWholeFileIsReadAsOneChunkByDefault(self):
+        chunks = list(read_json_line_chunks(self.file_path))
+        self.assertEqual(len(chunks), 1)
+        line_offsets, line_lengths, columns = chunks[0]
+        self.assertEqual(line_offsets, self.expected_offsets)
+        self.assertEqual(line_lengths, self.expected_lengths)
+        self.assertEqual(columns['manufacturer'], [u'Canon', u'Sony', u'Nikon'])
+
+    def testFileIsReadInChunksOfTheGivenSize(self):
+        chunks = list(read_json_line_chunks(self.file_path, chunk_size = 2))
+        self.assertEqual([line_offsets for (line_offsets, line_lengths, columns) in chunks],
+            [self.expected_offsets[:2], self.expected_offsets[2:]])
+        self.assertEqual([columns['title'][0] for (line_offsets, line_lengths, columns) in chunks],
+            [u'Canon PowerShot SD980 IS', u'Nikon D300S \xe9dition'])
+
+    def testChunkSizeMustBePositive(self):
+        for chunk_size in [0, -1]:
+            self.assertRaises(ValueError, read_json_line_chunks, self.file_path, chunk_size)
+
+class RegroupJsonLineBlocksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.blocks = [
+            ([0, 10, 20], [9, 9, 9], { 'a': [1, 2, 3] }),
+            ([30, 40], [9, 9], { 'a': [4, 5], 'b': ['x', 'y'] })
+        ]
+
+    def testBlocksAreRegroupedIntoChunksOfTheGivenSize(self):
+        chunks = list(regroup_json_line_blocks(self.blocks, chunk_size = 2))
+        self.assertEqual([line_offsets for (line_offsets, line_lengths, columns) in chunks], 
+            [[0, 10], [20, 30], [40]])
+        self.assertEqual([columns['a'] for (line_offsets, line_lengths, columns) in chunks], [[1, 2], [3, 4], [5]])
+
+    def testMissingFieldsAreNaN(self):
+        chunks = list(regroup_json_line_blocks(self.blocks))
+        self.assertEqual(len(chunks), 1)
+        line_offsets, line_lengths, columns = chunks[0]
+        self.assertEqual(columns['a'], [1, 2, 3, 4, 5])
+        self.assertTrue(all(math.isnan(value) for value in columns['b'][:3]))
+        self.assertEqual(columns['b'][3:], ['x', 'y'])
+
+class CachedJsonLineChunksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.cache_dir, 'listings.txt')
+        self.write_json_lines(['{"title": "Canon EOS 7D"}\n', '{"title": "Sony DSC-W310"}\n'])
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def write_json_lines(self, lines):
+        with open(self.file_path, 'wb') as json_lines_file:
+            json_lines_file.write(''.join(lines))
+
+    def read_titles(self):
+        return [title for (line_offsets, line_lengths, columns) 
+                in read_json_line_chunks(self.file_path, chunk_size = 1, cache_dir = self.cache_dir)
+                for title in columns['title']]
+
+    def testCachedChunksAreTheSameAsParsedChunks(self):
+        parsed_chunks = list(read_json_line_chunks(self.file_path, chunk_size = 1))
+        first_chunks = list(read_json_line_chunks(self.file_path, chunk_size = 1, cache_dir = self.cache_dir))
+        self.assertTrue(os.path.exists(get_cache_file_path(self.file_path, self.cache_dir)))
+        cached_chunks = list(read_json_line_chunks(self.file_path, chunk_size = 1, cache_dir = self.cache_dir))
+        self.assertEqual(first_chunks, parsed_chunks)
+        self.assertEqual(cached_chunks, parsed_chunks)
+
+    def testCacheIsInvalidatedWhenTheFileChanges(self):
+        self.assertEqual(self.read_titles(), [u'Canon EOS 7D', u'Sony DSC-W310'])
+        self.write_json_lines(['{"title": "Nikon D90"}\n'])
+        self.assertEqual(self.read_titles(), [u'Nikon D90'])
+
+    def testTruncatedOrDamagedCacheIsRebuiltWithoutLosingLines(self):
+        saved_cache_block_size = recordlinker.streaming.CACHE_BLOCK_SIZE
+        recordlinker.streaming.CACHE_BLOCK_SIZE = 1
+        try:
+            self.write_json_lines(['{"title": "Canon EOS 7D"}\n', '{"title": "Sony DSC-W310"}\n', '{"title": "Nikon D90"}\n'])
+            expected_titles = [u'Canon EOS 7D', u'Sony DSC-W310', u'Nikon D90']
+            self.assertEqual(self.read_titles(), expected_titles)
+            cache_file_path = get_cache_file_path(self.file_path, self.cache_dir)
+            with open(cache_file_path, 'rb') as cache_file:
+                cache_contents = cache_file.read()
+            for cache_length in range(1, len(cache_contents)):
+                for damaged_contents in [cache_contents[:cache_length], cache_contents[:cache_length] + '\xff\xff']:
+                    with open(cache_file_path, 'wb') as cache_file:
+                        cache_file.write(damaged_contents)
+                    self.assertEqual(self.read_titles(), expected_titles)
+                    with open(cache_file_path, 'rb') as cache_file:
+                        self.assertEqual(cache_file.read(), cache_contents)
+        finally:
+            recordlinker.streaming.CACHE_BLOCK_SIZE = saved_cache_block_size
+
+class PickledCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_file_path = os.path.join(self.cache_dir, 'sub_folder', 'cache.pickle')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def testMissingCacheFileGivesNone(self):
+        self.assertIsNone(load_pickled_cache(self.cache_file_path, { 'version': 1 }))
+
+    def testSavedObjectIsLoadedIfTheHeaderIsUnchanged(self):
+        save_pickled_cache(self.cache_file_path, { 'version': 1 }, { u'canon': u'canon' })
+        self.assertEqual(load_pickled_cache(self.cache_file_path, { 'version': 1 }), { u'canon': u'canon' })
+        self.assertIsNone(load_pickled_cache(self.cache_file_path, { 'version': 2 }))
+
+class JsonLinesMemoryMapTestCase(unittest.TestCase):
+    def setUp(self):
+        file_handle, self.file_path = tempfile.mkstemp(suffix = '.txt')
+        self.json_file_handle = file_handle
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def testRawRecordIsReadFromItsOffsetAndLength(self):
+        expected_raw_record = '{"title":"Nikon D300S \\u00e9dition"}'
+        with os.fdopen(self.json_file_handle, 'wb') as json_lines_file:
+            json_lines_file.write('{"a": 1}\r\n' + expected_raw_record + '\n')
+        with JsonLinesMemoryMap(self.file_path) as json_lines_map:
+            raw_record = json_lines_map.get_raw_record(10, len(expected_raw_record))
+        self.assertEqual(raw_record, expected_raw_record)
+        self.assertEqual(json.loads(raw_record)['title'], u'Nikon D300S \xe9dition')
+
+    def testEmptyFileCanBeOpened(self):
+        os.close(self.json_file_handle)
+        with JsonLinesMemoryMap(self.file_path) as json_lines_map:
+            self.assertEqual(json_lines_map.get_raw_record(0, 0), '')
+
+class AtomicFileWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.output_dir, 'cache.pickle')
+        with open(self.file_path, 'wb') as old_file:
+            old_file.write('old cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def read_file(self):
+        with open(self.file_path, 'rb') as output_file:
+            return output_file.read()
+
+    def testFileIsReplacedAtTheEndOfTheWithBlock(self):
+        with AtomicFileWriter(self.file_path) as output_file:
+            output_file.write('new cache')
+            self.assertEqual(self.read_file(), 'old cache')
+        self.assertEqual(self.read_file(), 'new cache')
+        self.assertEqual(os.listdir(self.output_dir), ['cache.pickle'])
+
+    def testFileIsNotReplacedIfAGeneratorIsClosedBeforeItFinishes(self):
+        def generate_and_write(items):
+            with AtomicFileWriter(self.file_path) as output_file:
+                for item in items:
+                    output_file.write(item)
+                    yield item
+        generator = generate_and_write(['a', 'b'])
+        self.assertEqual(next(generator), 'a')
+        generator.close()
+        self.assertEqual(self.read_file(), 'old cache')
+        self.assertEqual(os.listdir(self.output_dir), ['cache.pickle'])
+
+class JsonLinesWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.output_dir, 'results.txt')
+        with open(self.file_path, 'wb') as old_file:
+            old_file.write('old results')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def read_file(self):
+        with open(self.file_path, 'rb') as output_file:
+            return output_file.read()
+
+    def testLinesAreSeparatedByLineBreaks(self):
+        lines = ['{"listings": [], "product_name": "Canon_EOS_7D"}', '{"listings": [], "product_name": "Nikon_D90"}']
+        with JsonLinesWriter(self.file_path) as writer:
+            for line in lines:
+                writer.write_line(line)
+        self.assertEqual(self.read_file(), '\n'.join(lines))
+        self.assertEqual(writer.line_count, 2)
+        self.assertEqual(writer.byte_count, len('\n'.join(lines)))
+
+    def testFileIsOnlyReplacedWhenTheWriterIsClosed(self):
+        writer = JsonLinesWriter(self.file_path, buffer_size = 1)
+        writer.write_line('{"a": 1}')
+        self.assertEqual(self.read_file(), 'old results')
+        writer.close()
+        self.assertEqual(self.read_file(), '{"a": 1}')
+        self.assertEqual(os.listdir(self.output_dir), ['results.txt'])
+
+    def testFileIsNotReplacedIfAnErrorOccurs(self):
+        try:
+            with JsonLinesWriter(self.file_path) as writer:
+                writer.write_line('{"a": 1}')
+                raise ValueError('generating the results failed')
+        except ValueError:
+            pass
+        self.assertEqual(self.read_file(), 'old results')
+        self.assertEqual(os.listdir(self.output_dir), ['results.txt'])
+
+
+# Run unit tests from the command line:
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+from recordlinker.titles import *
+
+class TitleSplitterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.splitter = TitleSplitter([ u'for', u'pour', u'f\xfcr', u'fur', u'fuer', 'with', 'w/', 'avec', 'mit', '+' ])
+
+    def assertSameSplitAsRegex(self, title, expected_split):
+        self.assertEqual(self.splitter.split(title), expected_split)
+        self.assertEqual(self.splitter.split_with_regex(title), expected_split)
+
+    def testTitleWithoutSplitTerms(self):
+        self.assertSameSplitAsRegex(u'  Canon PowerShot SD980 IS  ', (u'Canon PowerShot SD980 IS', None))
+
+    def testTitleIsSplitAtTheFirstSplitTerm(self):
+        self.assertSameSplitAsRegex(u'Battery for Canon EOS 7D with charger',
+            (u'Battery', u'Canon EOS 7D with charger'))
+        self.assertSameSplitAsRegex(u'Nikon D90 + 18-105mm Lens', (u'Nikon D90', u'18-105mm Lens'))
+
+    def testSplitTermsAreCaseInsensitiveWholeWords(self):
+        self.assertSameSplitAsRegex(u'Tasche F\xdcR Sony Cyber-shot', (u'Tasche', u'Sony Cyber-shot'))
+        self.assertSameSplitAsRegex(u'Fortis formula forte', (u'Fortis formula forte', None))
+
+    def testUnusualTitlesGiveTheSameSplitAsTheRegex(self):
+        self.assertSameSplitAsRegex(u'Nikon D90 for X', (u'Nikon D90', u' X'))
+        self.assertSameSplitAsRegex(u'Sony T99\nfor case', (u'Sony T99', u'case'))
+        self.assertSameSplitAsRegex(u'Olympus for  ;x ', (u'Olympus', u';x'))
+
+    def testSplitTermsWhichArePrefixesOfOtherTermsGiveTheSameSplitAsTheRegex(self):
+        splitter = TitleSplitter([u'for', u'fore'])
+        for title in [u'Lens fore Canon EOS', u'Lens for Canon EOS', u'Lens forest for Canon EOS']:
+            self.assertEqual(splitter.split(title), splitter.split_with_regex(title))
+        self.assertEqual(splitter.split(u'Lens fore Canon EOS'), (u'Lens', u'e Canon EOS'))
+
+    def testSplitAll(self):
+        titles = [u'Lens for Nikon D90', u'Canon EOS 7D', u'Lens for Nikon D90']
+        product_descs, extra_prod_details = self.splitter.split_all(titles)
+        self.assertEqual(product_descs, [u'Lens', u'Canon EOS 7D', u'Lens'])
+        self.assertEqual(extra_prod_details, [u'Nikon D90', None, u'Nikon D90'])
+
+
+# Run unit tests from the command line:
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import re
+from string import Template
+
+# --------------------------------------------------------------------------------------------------
+# Split product titles into a product description and ancillary information,
+# at the first split term (such as "for" or "with") which is a whole word.
+#
+# The split is defined by title_split_regex. But this runs a negative lookahead over all the split terms
+# at every character of the title, and backtracks badly on long titles.
+# So split() instead finds the first whole-word split term with a single search of the title for an
+# alternation of the split terms, and slices the title around it. This gives the same result as the regex,
+# except in unusual cases where the regex would need to backtrack (e.g. titles with line breaks,
+# or very short descriptions), for which the regex itself is used.
+#
+# Note: The regex starts the extra details after the first split term which matches where the whole-word term
+#       was found, even if it isn't a whole word (e.g. "for" rather than "fore", when both are split terms).
+#       So the regex is also used if that term is shorter than the whole-word term.
+#
+class TitleSplitter(object):
+    def __init__(self, split_terms):
+        split_terms_pattern = '|'.join([ re.escape(term) for term in split_terms ])
+        pattern_to_expand = ur'''
+        ^
+        \s*
+        (?P<productDesc>
+          (?:
+            (?!
+              (?<!\w)
+              (?:$split_terms_pattern)
+              (?!\w)
+            )
+            .
+          )+
+          # Ensure the last character is non-whitespace:
+          (?:
+            (?!
+              (?<!\w)
+              (?:$split_terms_pattern)
+              (?!\w)
+            )
+            \S
+          )
+        )
+        \s*
+        (?:
+          (?P<extraProdDetailsSection>
+            (?:
+              (?:$split_terms_pattern)
+              \W*
+            )
+            (?P<extraProdDetails>
+              .+
+              \S # Ensure the last character is non-whitespace:
+            )
+          )
+          \s*
+        )?
+        $$
+        '''
+        pattern_template = Template(pattern_to_expand)
+        title_split_pattern = pattern_template.substitute(split_terms_pattern=split_terms_pattern)
+        flags = re.IGNORECASE | re.UNICODE | re.VERBOSE
+        self.title_split_regex = re.compile(title_split_pattern, flags)
+        self.split_term_regex = re.compile(r'(?<!\w)(?:%s)(?!\w)' % split_terms_pattern, flags)
+        self.any_split_term_regex = re.compile(r'(?:%s)' % split_terms_pattern, flags)
+        self.non_word_chars_regex = re.compile(r'\W*', flags)
+
+    def split_with_regex(self, title):
+        title_match = self.title_split_regex.match(title)
+        return title_match.group('productDesc'), title_match.group('extraProdDetails')
+
+    def split(self, title):
+        '''Returns the (product_desc, extra_prod_details) tuple for a title, with None if there are no extra details'''
+        if not isinstance(title, unicode) or u'\n' in title:
+            return self.split_with_regex(title)
+        start = len(title) - len(title.lstrip())
+        split_term_match = self.split_term_regex.search(title, start)
+        if split_term_match is None:
+            product_desc = title[start:].rstrip()
+            extra_prod_details = None
+        else:
+            if self.any_split_term_regex.match(title, split_term_match.start()).end() != split_term_match.end():
+                return self.split_with_regex(title)
+            product_desc = title[start:split_term_match.start()].rstrip()
+            details_start = self.non_word_chars_regex.match(title, split_term_match.end()).end()
+            extra_prod_details = title[details_start:].rstrip()
+            if len(extra_prod_details) < 2:
+                return self.split_with_regex(title)
+        if len(product_desc) < 2:
+            return self.split_with_regex(title)
+        return product_desc, extra_prod_details
+
+    def split_all(self, titles):
+        '''Splits a sequence of titles, returning a list of product descriptions and a list of extra details'''
+        splits_by_title = {}
+        product_descs = []
+        extra_prod_details = []
+        for title in titles:
+            title_split = splits_by_title.get(title)
+            if title_split is None:
+                title_split = self.split(title)
+                splits_by_title[title] = title_split
+            product_descs.append(title_split[0])
+            extra_prod_details.append(title_split[1])
+        return product_descs, extra_prod_details
@@ -0,0 +1,68 @@
+# This script measures the throughput and peak memory of writing the result file:
+#   1. "join": joining all the result lines into one string, then writing it to the file
+#      (which is how the results were written before JsonLinesWriter).
+#   2. "stream": writing each result line with a JsonLinesWriter as soon as it is generated.
+#
+# Each method is run in its own process, since the peak memory (the maximum resident set size)
+# is only measured per process.
+#
+# It accepts optional command line parameters with the number of products and the number of listings per product
+# (the defaults are 20000 and 50). Run it from the python folder e.g. python writer_benchmark.py 20000 50
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from recordlinker.profiling import *
+from recordlinker.streaming import *
+
+# ----------------------------------------------------------------------
+# Generate synthetic result lines, with the same form as the lines of the result file:
+#
+listing_json = '{"title":"Sony Cyber-shot DSC-W310 12.1MP Digital Camera with 4x Wide Angle Zoom",' \
+    '"manufacturer":"Sony","currency":"CAD","price":"139.99"}'
+
+def generate_result_lines(product_count, listings_per_product):
+    for product_index in xrange(product_count):
+        yield '{"listings": [' + ', '.join([listing_json] * listings_per_product) \
+            + '], "product_name": "Sony_Cyber-shot_DSC-W%d"}' % product_index
+
+def write_results(method, output_file_path, product_count, listings_per_product):
+    result_lines = generate_result_lines(product_count, listings_per_product)
+    if method == 'join':
+        results_file_contents = '\n'.join(list(result_lines))
+        with open(output_file_path, 'wb') as results_file:
+            results_file.write(results_file_contents)
+    else:
+        with JsonLinesWriter(output_file_path) as results_file:
+            for result_line in result_lines:
+                results_file.write_line(result_line)
+
+# ----------------------------------------------------------------------
+# Measure a single method (in a child process), or compare both methods:
+#
+if len(sys.argv) > 1 and sys.argv[1] in ['join', 'stream']:
+    method, output_file_path, product_count, listings_per_product = \
+        sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+    start_time = time.time()
+    write_results(method, output_file_path, product_count, listings_per_product)
+    elapsed_time = time.time() - start_time
+    file_size_in_MB = os.path.getsize(output_file_path) / (1024.0 * 1024.0)
+    print '| %s | %.1f | %.2f | %.1f | %.1f |' % (
+        method, file_size_in_MB, elapsed_time, file_size_in_MB / elapsed_time, get_peak_memory_in_MB())
+else:
+    product_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    listings_per_product = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    output_folder_path = tempfile.mkdtemp()
+    print '| method | file size (MB) | seconds | MB per second | peak memory (MB) |'
+    print '|---|---|---|---|---|'
+    try:
+        for method in ['join', 'stream']:
+            output_file_path = os.path.join(output_folder_path, method + '.txt')
+            subprocess.check_call([sys.executable, __file__, method, output_file_path,
+                                   str(product_count), str(listings_per_product)])
+    finally:
+        for file_name in os.listdir(output_folder_path):
+            os.remove(os.path.join(output_folder_path, file_name))
+        os.rmdir(output_folder_path)